@@ -0,0 +1,22 @@
+import os
+import sys
+
+from werkzeug.utils import import_string
+
+
+# gunicorn reads this file before it puts the app directory on the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+app_config = import_string(os.getenv('APP_SETTINGS', 'plato.config.ProductionConfig'))
+
+bind = f'0.0.0.0:{os.getenv("PORT", 5000)}'
+workers = app_config.GUNICORN_WORKERS
+worker_class = app_config.GUNICORN_WORKER_CLASS
+threads = app_config.GUNICORN_THREADS
+timeout = app_config.GUNICORN_TIMEOUT
+# import wsgi.py, and so warm up, once in the master instead of in every worker
+preload_app = True
+
+
+def post_worker_init(worker):
+    from plato.warmup import warm_worker
+    warm_worker(worker.wsgi)
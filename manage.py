@@ -1,28 +1,28 @@
+import json
+import subprocess
+import sys
 import unittest
-import coverage
 
+from flask import current_app
 from flask_script import Manager
-from flask_migrate import MigrateCommand
 
-from plato import create_app, db
-from plato.api.models import User
 
+def create_app():
+    # plato pulls in SQLAlchemy, bcrypt, jwt and orjson, so it is only
+    # imported, and the app built, when a command runs
+    from plato import create_app
+    return create_app()
 
-COV = coverage.coverage(
-    branch=True,
-    include='plato/*',
-    omit=[
-        'plato/tests/*',
-        'plato/__init__.py'
-        'plato/config.py',
-    ]
-)
-COV.start()
 
+def add_migrate_command(argv):
+    # alembic alone takes longer to import than the rest of manage.py, so
+    # the db commands are only loaded when they, or the help, are asked for
+    if not argv or argv[0] in ('db', '-?', '--help'):
+        from flask_migrate import MigrateCommand
+        manager.add_command('db', MigrateCommand)
 
-app = create_app()
-manager = Manager(app)
-manager.add_command('db', MigrateCommand)
+
+manager = Manager(create_app)
 
 
 @manager.command
@@ -38,34 +38,131 @@ def test():
 @manager.command
 def cov():
     '''run the unittest with coverage'''
-    tests = unittest.TestLoader().discover('plato/test')
-    result = unittest.TextTestRunner(verbosity=2).run(tests)
-    if result.wasSuccessful():
-        COV.stop()
-        COV.stop()
-        COV.save()
+    # trace a separate run of the tests rather than this process, so coverage
+    # never slows down other commands and import-time lines are measured too
+    import coverage
+    code = subprocess.call([
+        sys.executable, '-m', 'coverage', 'run', '--branch',
+        '--include=plato/*', '--omit=plato/test/*,plato/__init__.py,plato/config.py',
+        'manage.py', 'test'
+    ])
+    if code == 0:
+        COV = coverage.coverage()
+        COV.load()
         print('Coverage Summary:')
         COV.report()
         COV.html_report()
         COV.erase()
-        return 0
-    return 1
+    return code
+
+
+@manager.option('-b', '--budget', dest='budget', type=float, default=None)
+def startup(budget):
+    '''Report where the time goes when manage.py is imported'''
+    from plato.startup import import_times, interpreter_time, STARTUP_BUDGET_SECONDS
+    budget = budget or STARTUP_BUDGET_SECONDS
+    elapsed, times = import_times('manage')
+    baseline = interpreter_time()
+    print(f'{"cumulative ms":>13} {"self ms":>8}  module')
+    for cumulative, own, module in times[:25]:
+        print(f'{cumulative / 1000:13.1f} {own / 1000:8.1f}  {module}')
+    print(f'Startup took {elapsed * 1000:.0f} ms, {(elapsed - baseline) * 1000:.0f} ms over '
+          f'a bare interpreter (budget {budget * 1000:.0f} ms)')
+    return 0 if elapsed - baseline <= budget else 1
 
 
 @manager.command
 def recreate_db():
+    from plato import db
     db.drop_all()
     db.create_all()
     db.session.commit()
 
 
 @manager.command
-def seed_db():
-    '''Seeds the database'''
+def prune_refresh_tokens():
+    '''Deletes expired refresh tokens'''
+    from plato import db
+    from plato.api.models import RefreshToken
+    pruned = RefreshToken.prune()
+    db.session.commit()
+    print(f'Deleted {pruned} expired refresh tokens')
+
+
+@manager.option('-c', '--count', dest='count', type=int, default=0)
+@manager.option('-s', '--seed', dest='seed', type=int, default=0)
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=10000)
+def seed_db(count, seed, batch_size):
+    '''Seeds the database, with --count generated users if given'''
+    from plato import db
+    from plato.api.models import User
+    from plato.seed import seed_users
+    if count:
+        seed_users(count, seed, batch_size, progress=print)
+        return
     db.session.add(User('michael', 'michael@.com', 'test_pwd'))
     db.session.add(User('michaelherman', 'michaelherman@realpython.com', 'test_pwd'))
     db.session.commit()
 
 
+@manager.option('-t', '--target-ms', dest='target_ms', type=int, default=250)
+def calibrate_bcrypt(target_ms):
+    '''Benchmark bcrypt on this host and recommend BCRYPT_LOG_ROUNDS'''
+    from plato.hashing import calibrate
+    recommended, timings = calibrate(target_ms / 1000)
+    for rounds, seconds in timings.items():
+        print(f'cost {rounds:2d}: {seconds * 1000:8.1f} ms')
+    print(f'Recommended BCRYPT_LOG_ROUNDS for {target_ms} ms: {recommended}')
+    print(f'Currently configured: {current_app.config.get("BCRYPT_LOG_ROUNDS")}')
+
+
+@manager.option('-n', '--requests', dest='requests', type=int, default=1000)
+@manager.option('-c', '--concurrency', dest='concurrency', type=int, default=4)
+@manager.option('-m', '--mix', dest='mix', default=None)
+@manager.option('-u', '--users', dest='users', type=int, default=1000)
+@manager.option('-d', '--database-url', dest='database_url', default=None)
+@manager.option('-o', '--output', dest='output', default='bench_results.json')
+@manager.option('-b', '--baseline', dest='baseline', default=None)
+@manager.option('-t', '--tolerance', dest='tolerance', type=float, default=0.2)
+def bench(requests, concurrency, mix, users, database_url, output, baseline, tolerance):
+    '''Benchmark the main endpoints and compare against a baseline'''
+    from plato.bench import bench_database, run_benchmark, compare, DEFAULT_MIX
+    app = current_app._get_current_object()
+    # a throwaway SQLite file unless --database-url names a database to seed
+    with bench_database(app, database_url):
+        results = run_benchmark(app, requests, concurrency, mix or DEFAULT_MIX, users)
+    print(f'{"endpoint":10} {"requests":>8} {"errors":>6} {"req/s":>9} '
+          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for name, summary in list(results['endpoints'].items()) + [('total', results['total'])]:
+        print(f'{name:10} {summary["requests"]:8d} {summary["errors"]:6d} '
+              f'{summary["throughput"]:9.1f} {summary["p50_ms"]:8.2f} '
+              f'{summary["p95_ms"]:8.2f} {summary["p99_ms"]:8.2f}')
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+    return 0
+
+
+@manager.option('-u', '--users', dest='users', type=int, default=10000)
+@manager.option('-r', '--repeat', dest='repeat', type=int, default=5)
+def bench_json(users, repeat):
+    '''Compare JSON backends on a GET /users payload'''
+    from plato.bench import json_benchmark
+    results = json_benchmark(users, repeat)
+    baseline = results['flask']['ms']
+    print(f'{"backend":8} {"ms":>8} {"bytes":>10} {"speedup":>8}')
+    for name, result in results.items():
+        print(f'{name:8} {result["ms"]:8.2f} {result["bytes"]:10d} '
+              f'{baseline / result["ms"]:7.1f}x')
+    return 0
+
+
 if __name__ == '__main__':
+    add_migrate_command(sys.argv[1:])
     manager.run()
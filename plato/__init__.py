@@ -1,16 +1,31 @@
 import os
 
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_migrate import Migrate
-from flask_bcrypt import Bcrypt
+
+from plato.availability import AvailabilityIndex
+from plato.cache import TokenCache, ListingCache
+from plato.database import RoutingSQLAlchemy, ReplicaRouter
+from plato.hashing import PasswordHasher
+from plato.instrumentation import Instrumentation
+from plato.serialization import JSONProvider
+from plato.tokens import TokenRevocations, TokenDenylist, TokenSigner
 
 
 # instantiate the db
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+replicas = ReplicaRouter()
 migrate = Migrate()
-bcrypt = Bcrypt()
+hasher = PasswordHasher()
+token_cache = TokenCache()
+listing_cache = ListingCache()
+instrumentation = Instrumentation()
+json_provider = JSONProvider()
+availability = AvailabilityIndex()
+revocations = TokenRevocations()
+denylist = TokenDenylist()
+signer = TokenSigner()
 
 
 def create_app():
@@ -26,13 +41,26 @@ def create_app():
 
     # setup extensions
     db.init_app(app)
-    bcrypt.init_app(app)
+    replicas.init_app(app)
+    hasher.init_app(app)
     migrate.init_app(app, db)
+    token_cache.init_app(app)
+    listing_cache.init_app(app)
+    instrumentation.init_app(app)
+    json_provider.init_app(app)
+    availability.init_app(app)
+    revocations.init_app(app)
+    denylist.init_app(app)
+    signer.init_app(app)
 
     # register blueprints
     from plato.api.users import users_blueprint
     from plato.api.auth import auth_blueprint
+    from plato.api.metrics import metrics_blueprint
+    from plato.api.health import health_blueprint
     app.register_blueprint(users_blueprint)
     app.register_blueprint(auth_blueprint)
+    app.register_blueprint(metrics_blueprint)
+    app.register_blueprint(health_blueprint)
 
     return app
@@ -1,9 +1,11 @@
-from flask import Blueprint, jsonify, request, make_response
-from sqlalchemy import exc, or_
+from flask import Blueprint, request, make_response
+from sqlalchemy import exc, exists, orm
 
-from plato import db, bcrypt
-from plato.api.models import User
-from plato.api.utils import authenticate
+from plato import db, hasher, availability, denylist, signer
+from plato.hashing import HasherBusy
+from plato.serialization import jsonify
+from plato.api.models import User, RefreshToken
+from plato.api.utils import authenticate, replica_reads, get_current_user
 
 
 auth_blueprint = Blueprint('auth', __name__)
@@ -23,20 +25,16 @@ def register_user():
     email = post_data.get('email')
     password = post_data.get('password')
     try:
-        user = User.query.filter(or_(User.username == username, User.email == email)).first()
-        if not user:
-            new_user = User(
-                username=username,
-                email=email,
-                password=password
-            )
-            db.session.add(new_user)
+        user_id, conflict = User.create(username=username, email=email, password=password)
+        if not conflict:
+            refresh_token = RefreshToken.issue(user_id)
             db.session.commit()
-            auth_token = new_user.encode_auth_token(new_user.id)
+            auth_token = User.encode_auth_token(user_id, {'active': True, 'admin': False})
             response_object = {
                 'status': 'success',
                 'message': 'Successfully registered',
-                'auth_token': auth_token.decode()
+                'auth_token': auth_token.decode(),
+                'refresh_token': refresh_token
             }
             return make_response(jsonify(response_object)), 201
         else:
@@ -59,6 +57,13 @@ def register_user():
             'message': 'Invalid payload'
         }
         return make_response(jsonify(response_object)), 400
+    except HasherBusy:
+        db.session().rollback()
+        response_object = {
+            'status': 'error',
+            'message': 'Server is busy. Please try again later.'
+        }
+        return make_response(jsonify(response_object)), 503
 
 
 @auth_blueprint.route('/auth/login', methods=['POST'])
@@ -77,13 +82,18 @@ def login_user():
     try:
         # fetch the user data
         user = User.query.filter_by(email=email).first()
-        if user and bcrypt.check_password_hash(user.password, password):
-            auth_token = user.encode_auth_token(user.id)
+        if user and hasher.check_password_hash(user.password, password):
+            if user.password_needs_rehash():
+                rehash_password(user, password)
+            auth_token = user.encode_auth_token(user.id, {'active': user.active, 'admin': user.admin})
             if auth_token:
+                refresh_token = RefreshToken.issue(user.id)
+                db.session.commit()
                 response_object = {
                     'status': 'success',
                     'message': 'Successfully logged in',
-                    'auth_token': auth_token.decode()
+                    'auth_token': auth_token.decode(),
+                    'refresh_token': refresh_token
                 }
                 return make_response(jsonify(response_object)), 200
         else:
@@ -92,6 +102,12 @@ def login_user():
                 'message': 'User does not exists'
             }
             return make_response(jsonify(response_object)), 404
+    except HasherBusy:
+        response_object = {
+            'status': 'error',
+            'message': 'Server is busy. Please try again later.'
+        }
+        return make_response(jsonify(response_object)), 503
     except Exception as e:
         response_object = {
             'status': 'error',
@@ -100,9 +116,97 @@ def login_user():
         return make_response(jsonify(response_object)), 500
 
 
+@auth_blueprint.route('/auth/refresh', methods=['POST'])
+def refresh_auth_token():
+    '''Trade a refresh token for a new access token and the next refresh token'''
+    post_data = request.get_json(silent=True)
+    token = post_data.get('refresh_token') if isinstance(post_data, dict) else None
+    if not isinstance(token, str) or not token:
+        response_object = {
+            'status': 'error',
+            'message': 'Invalid payload'
+        }
+        return make_response(jsonify(response_object)), 400
+    user, refresh_token = RefreshToken.rotate(token)
+    db.session.commit()
+    if user is None:
+        response_object = {
+            'status': 'error',
+            'message': 'Invalid refresh token. Please log in again.'
+        }
+        return make_response(jsonify(response_object)), 401
+    auth_token = User.encode_auth_token(user.id, {'active': user.active, 'admin': user.admin})
+    response_object = {
+        'status': 'success',
+        'message': 'Successfully refreshed',
+        'auth_token': auth_token.decode(),
+        'refresh_token': refresh_token
+    }
+    return make_response(jsonify(response_object)), 200
+
+
+@auth_blueprint.route('/.well-known/jwks.json', methods=['GET'])
+def get_jwks():
+    '''Publish the public keys tokens are signed with, for local verification'''
+    response = jsonify(signer.jwks())
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response, 200
+
+
+@auth_blueprint.route('/auth/available', methods=['GET'])
+def check_availability():
+    '''Check whether a username and/or email is still free'''
+    fields = {
+        field: request.args.get(field)
+        for field in ('username', 'email') if request.args.get(field)
+    }
+    if not fields:
+        response_object = {
+            'status': 'error',
+            'message': 'Provide a username or email'
+        }
+        return make_response(jsonify(response_object)), 400
+    available = {}
+    for field, value in fields.items():
+        if not availability.might_exist(field, value):
+            available[field] = True
+        else:
+            # possible hit, which may be a false positive: ask the database
+            column = getattr(User, field)
+            available[field] = not db.session.query(exists().where(column == value)).scalar()
+    response_object = {
+        'status': 'success',
+        'data': {
+            'available': available
+        }
+    }
+    return make_response(jsonify(response_object)), 200
+
+
 @auth_blueprint.route('/auth/logout', methods=['GET'])
 @authenticate
-def logout_user(_):
+def logout_user(identity):
+    '''Revoke the access token and end its session
+
+    The refresh token, from the X-Refresh-Token header or a JSON body,
+    ends just that session; the user's other devices stay logged in.
+    Every session ends only when asked for, with ?everywhere=true or
+    "everywhere": true in the JSON body.
+    '''
+    denylist.add(identity.jti, identity.expires_at)
+    token = request.headers.get('X-Refresh-Token')
+    everywhere = request.args.get('everywhere', '').lower() in ('1', 'true')
+    post_data = request.get_json(silent=True)
+    if isinstance(post_data, dict):
+        if token is None:
+            token = post_data.get('refresh_token')
+        everywhere = everywhere or post_data.get('everywhere') is True
+    if everywhere:
+        RefreshToken.revoke_all(identity.id)
+    elif isinstance(token, str) and token:
+        RefreshToken.revoke(identity.id, token)
+    db.session.commit()
     response_object = {
         'status': 'success',
         'message': 'Successfully logged out'
@@ -111,9 +215,17 @@ def logout_user(_):
 
 
 @auth_blueprint.route('/auth/status', methods=['GET'])
+@replica_reads
 @authenticate
-def get_user_status(resp):
-    user = User.query.filter_by(id=resp).first()
+def get_user_status(_):
+    user = get_current_user()
+    if user is None:
+        # a token trusted by its claims can outlive the user it names
+        response_object = {
+            'status': 'error',
+            'message': 'Something went wrong. Please contact us.'
+        }
+        return make_response(jsonify(response_object)), 401
     response_object = {
         'status': 'success',
         'data': {
@@ -125,3 +237,14 @@ def get_user_status(resp):
         }
     }
     return make_response(jsonify(response_object)), 200
+
+
+def rehash_password(user, password):
+    '''Re-hash a verified password with the configured cost, best effort'''
+    try:
+        user.password = User.hash_password(password)
+        db.session.commit()
+    except (HasherBusy, orm.exc.StaleDataError):
+        # the old hash still verifies, so try again on a later login; a
+        # stale version means a concurrent login has already re-hashed it
+        db.session.rollback()
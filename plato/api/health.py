@@ -0,0 +1,43 @@
+from flask import Blueprint, make_response
+from sqlalchemy import exc
+
+from plato import db, replicas
+from plato.database import pool_stats
+from plato.serialization import jsonify
+
+
+health_blueprint = Blueprint('health', __name__)
+
+
+def database_engines():
+    '''Yield (name, engine) for the primary and every configured replica'''
+    yield 'primary', db.engine
+    for replica in replicas.replicas:
+        yield replica, db.get_engine(bind=replica)
+
+
+@health_blueprint.route('/health/ready', methods=['GET'])
+def readiness():
+    '''Check the primary database is reachable and report connection pool usage'''
+    replicas.check_health()
+    databases = {}
+    for name, engine in database_engines():
+        if name == 'primary':
+            try:
+                with engine.connect() as connection:
+                    connection.execute('SELECT 1')
+                healthy = True
+            except exc.SQLAlchemyError:
+                healthy = False
+        else:
+            healthy = name in replicas.healthy
+        databases[name] = {'healthy': healthy, 'pool': pool_stats(engine)}
+    # replicas are optional: reads fall back to the primary without them
+    ready = databases['primary']['healthy']
+    response_object = {
+        'status': 'success' if ready else 'fail',
+        'data': {
+            'databases': databases
+        }
+    }
+    return make_response(jsonify(response_object)), 200 if ready else 503
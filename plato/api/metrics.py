@@ -0,0 +1,72 @@
+from flask import Blueprint, make_response
+
+from plato import hasher, instrumentation, token_cache, listing_cache, denylist
+from plato.api.health import database_engines
+from plato.database import pool_stats
+
+
+metrics_blueprint = Blueprint('metrics', __name__)
+
+
+def gauge(name, documentation, value, kind='gauge'):
+    return [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}', f'{name} {value}']
+
+
+def labelled(name, documentation, values, kind='gauge'):
+    '''Like gauge, with one series per database'''
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for database, value in values.items():
+        lines.append(f'{name}{{database="{database}"}} {value}')
+    return lines
+
+
+POOL_METRICS = (
+    ('checked_out', 'plato_db_pool_checked_out', 'Connections in use.', 'gauge'),
+    ('checked_in', 'plato_db_pool_checked_in', 'Idle connections in the pool.', 'gauge'),
+    ('overflow', 'plato_db_pool_overflow', 'Connections open beyond the pool size.', 'gauge'),
+    ('waits', 'plato_db_pool_checkouts_total', 'Connection checkouts.', 'counter'),
+    ('wait_seconds', 'plato_db_pool_wait_seconds_total',
+     'Time spent waiting for a pooled connection.', 'counter'),
+    ('timeouts', 'plato_db_pool_timeouts_total',
+     'Checkouts that timed out waiting for a connection.', 'counter')
+)
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+def get_metrics():
+    '''Expose request histograms and cache/pool stats in Prometheus format'''
+    lines = []
+    for histogram in instrumentation.histograms():
+        lines.extend(histogram.render())
+    cache = token_cache.stats()
+    lines.extend(gauge('plato_token_cache_hits_total', 'Token cache hits.',
+                       cache['hits'], 'counter'))
+    lines.extend(gauge('plato_token_cache_misses_total', 'Token cache misses.',
+                       cache['misses'], 'counter'))
+    lines.extend(gauge('plato_token_cache_size', 'Tokens currently cached.', cache['size']))
+    listing = listing_cache.stats()
+    lines.extend(gauge('plato_listing_cache_hits_total', 'User listing pages served from cache.',
+                       listing['hits'], 'counter'))
+    lines.extend(gauge('plato_listing_cache_misses_total', 'User listing pages rendered.',
+                       listing['misses'], 'counter'))
+    lines.extend(gauge('plato_listing_cache_size', 'User listing pages cached.', listing['size']))
+    lines.extend(gauge('plato_token_denylist_size', 'Logged out tokens not yet expired.',
+                       len(denylist)))
+    hashing = hasher.stats()
+    lines.extend(gauge('plato_bcrypt_calls_total', 'bcrypt hashes and checks run.',
+                       hashing['calls'], 'counter'))
+    lines.extend(gauge('plato_bcrypt_rejected_total', 'bcrypt calls rejected as busy.',
+                       hashing['rejected'], 'counter'))
+    lines.extend(gauge('plato_bcrypt_queue_wait_seconds_total',
+                       'Time bcrypt calls waited for a worker.',
+                       hashing['queue_wait_seconds'], 'counter'))
+    lines.extend(gauge('plato_bcrypt_hash_seconds_total', 'Time spent hashing in workers.',
+                       hashing['hash_seconds'], 'counter'))
+    pools = {name: pool_stats(engine) for name, engine in database_engines()}
+    for key, name, documentation, kind in POOL_METRICS:
+        values = {database: stats[key] for database, stats in pools.items() if key in stats}
+        if values:
+            lines.extend(labelled(name, documentation, values, kind))
+    response = make_response('\n'.join(lines) + '\n')
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    return response
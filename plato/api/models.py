@@ -1,13 +1,24 @@
 import jwt
 import datetime
+import hashlib
+import secrets
+import uuid
 
 from flask import current_app
+from sqlalchemy import event, exc, inspect, orm, or_
+from sqlalchemy.dialects import postgresql
 
-from plato import db, bcrypt
+from plato import db, hasher, token_cache, listing_cache, availability, replicas, revocations, \
+    signer
+from plato.hashing import hash_cost
+from plato.instrumentation import timed
 
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_created_at_id', 'created_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     username = db.Column(db.String(128), unique=True, nullable=False)
     email = db.Column(db.String(128), unique=True, nullable=False)
@@ -15,13 +26,17 @@ class User(db.Model):
     active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False)
     admin = db.Column(db.Boolean, default=False, nullable=True)
+    # bumped by the ORM on every UPDATE; ETags are derived from it
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+
+    __mapper_args__ = {
+        'version_id_col': version
+    }
 
     def __init__(self, username, email, password, created_at=datetime.datetime.now()):
         self.username = username
         self.email = email
-        self.password = bcrypt.generate_password_hash(
-            password, current_app.config.get('BCRYPT_LOG_ROUNDS')
-        ).decode()
+        self.password = User.hash_password(password)
         self.created_at = created_at
 
     def __repr__(self):
@@ -29,22 +44,128 @@ class User(db.Model):
                '\n email: ' + self.email + \
                '\n password: ' + self.password
 
-    def encode_auth_token(self, user_id):
-        """Generates the auth token"""
+    @staticmethod
+    def hash_password(password):
+        """Hashes a password with the configured bcrypt cost"""
+        return hasher.generate_password_hash(
+            password, current_app.config.get('BCRYPT_LOG_ROUNDS')
+        ).decode()
+
+    @staticmethod
+    def create(username, email, password, created_at=None):
+        """Inserts a user in a single statement - :return: (id, None)|(None, 'username'|'email')
+
+        On Postgres this is INSERT ... ON CONFLICT DO NOTHING RETURNING id;
+        other dialects attempt a plain INSERT in a SAVEPOINT and catch the
+        IntegrityError, leaving the rest of the caller's transaction alone.
+        Either way the extra lookup for the conflicting column only runs when
+        there was a conflict. On Postgres the conflicting user can be deleted
+        before that lookup finds it, so the INSERT is tried once more.
+        """
+        values = {
+            'username': username,
+            'email': email,
+            'password': User.hash_password(password),
+            'active': True,
+            'admin': False,
+            'created_at': created_at or datetime.datetime.now()
+        }
+        table = User.__table__
+        if db.engine.dialect.name == 'postgresql':
+            statement = postgresql.insert(table).values(**values) \
+                .on_conflict_do_nothing().returning(table.c.id)
+            for _ in range(2):
+                user_id = db.session.execute(statement).scalar()
+                if user_id is not None:
+                    break
+                conflict = User.find_conflict(username, email)
+                if conflict is not None:
+                    return None, conflict
+            else:
+                raise RuntimeError(f'inserting user {username} conflicted with users that are gone')
+            availability.add(username, email)
+            replicas.pin(user_id)
+            invalidate_listing(db.session(), values['created_at'], user_id)
+            return user_id, None
         try:
+            with db.session.begin_nested():
+                result = db.session.execute(table.insert().values(**values))
+        except exc.IntegrityError:
+            conflict = User.find_conflict(username, email)
+            if conflict is None:
+                raise
+            return None, conflict
+        availability.add(username, email)
+        replicas.pin(result.inserted_primary_key[0])
+        invalidate_listing(db.session(), values['created_at'], result.inserted_primary_key[0])
+        return result.inserted_primary_key[0], None
+
+    @staticmethod
+    def insert_many(rows):
+        """Inserts rows, skipping those that clash with existing users - :return: usernames inserted
+
+        On Postgres this is one INSERT ... ON CONFLICT DO NOTHING RETURNING
+        username; other dialects insert row by row, each in a SAVEPOINT.
+        """
+        table = User.__table__
+        if not rows:
+            return set()
+        if db.engine.dialect.name == 'postgresql':
+            statement = postgresql.insert(table).values(rows) \
+                .on_conflict_do_nothing().returning(table.c.username)
+            return {username for username, in db.session.execute(statement)}
+        inserted = set()
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert().values(**row))
+            except exc.IntegrityError:
+                continue
+            inserted.add(row['username'])
+        return inserted
+
+    @staticmethod
+    def find_conflict(username, email):
+        """Names the unique column an existing user shares - :return: 'email'|'username'|None"""
+        user = db.session.query(User.username, User.email) \
+            .filter(or_(User.username == username, User.email == email)).first()
+        if user is None:
+            return None
+        return 'email' if user.email == email else 'username'
+
+    def password_needs_rehash(self):
+        """Whether the stored hash was made with a different cost than configured"""
+        return hash_cost(self.password) != current_app.config.get('BCRYPT_LOG_ROUNDS')
+
+    @staticmethod
+    def encode_auth_token(user_id, claims=None):
+        """Generates the auth token
+
+        With TOKEN_CLAIMS set, claims (the user's active and admin flags) are
+        embedded so authenticate can trust them without loading the user.
+        Such tokens live at most TOKEN_CLAIMS_MAX_AGE seconds.
+        """
+        try:
+            now = datetime.datetime.utcnow()
+            lifetime = datetime.timedelta(
+                days=current_app.config.get('TOKEN_EXPIRATION_DAYS'),
+                seconds=current_app.config.get('TOKEN_EXPIRATION_SECONDS')
+            )
             payload = {
-                'exp': datetime.datetime.utcnow() + datetime.timedelta(
-                    days=current_app.config.get('TOKEN_EXPIRATION_DAYS'),
-                    seconds=current_app.config.get('TOKEN_EXPIRATION_SECONDS')
-                ),
-                'iat': datetime.datetime.utcnow(),
-                'sub': user_id
+                'exp': now + lifetime,
+                'iat': now,
+                'sub': user_id,
+                'jti': uuid.uuid4().hex
             }
-            auth_token = jwt.encode(
-                payload,
-                current_app.config.get('SECRET_KEY'),
-                algorithm='HS256'
-            )
+            if claims is not None and current_app.config.get('TOKEN_CLAIMS'):
+                max_age = datetime.timedelta(seconds=current_app.config.get('TOKEN_CLAIMS_MAX_AGE'))
+                payload['exp'] = now + min(lifetime, max_age)
+                # to the microsecond, so revocations can order tokens within a second
+                payload['iat'] = now.replace(tzinfo=datetime.timezone.utc).timestamp()
+                payload['active'] = bool(claims['active'])
+                payload['admin'] = bool(claims['admin'])
+            with timed('jwt'):
+                auth_token = signer.encode(payload)
             return auth_token
         except Exception as e:
             return e
@@ -52,10 +173,167 @@ class User(db.Model):
     @staticmethod
     def decode_auth_token(auth_token):
         """Decodes the auth token - :param auth_token: - :return: integer|string"""
+        payload = User.decode_auth_payload(auth_token)
+        if isinstance(payload, str):
+            return payload
+        return payload['sub']
+
+    @staticmethod
+    def decode_auth_payload(auth_token):
+        """Decodes the auth token - :param auth_token: - :return: dict|string"""
         try:
-            payload = jwt.decode(auth_token, current_app.config.get('SECRET_KEY'))
-            return payload['sub']
+            with timed('jwt'):
+                return signer.decode(auth_token)
         except jwt.ExpiredSignatureError as e:
             return 'Signature expired. Please log in again.'
         except jwt.InvalidTokenError as e:
             return 'Invalid token. Please log in again.'
+
+
+@event.listens_for(User, 'after_update')
+def invalidate_cached_tokens(mapper, connection, target):
+    """Drop cached tokens so active/admin changes apply on the next request"""
+    token_cache.invalidate_user(target.id)
+    replicas.pin(target.id)
+
+
+@event.listens_for(User, 'after_update')
+def revoke_stale_claims(mapper, connection, target):
+    """Void tokens whose embedded active/admin claims no longer hold"""
+    state = inspect(target)
+    if state.attrs.active.history.has_changes() or state.attrs.admin.history.has_changes():
+        revocations.revoke(target.id)
+
+
+@event.listens_for(User, 'after_update')
+def invalidate_listing_after_update(mapper, connection, target):
+    """Drop the listing pages showing the user, at its old place too if it moved"""
+    session = orm.object_session(target)
+    invalidate_listing(session, target.created_at, target.id)
+    for created_at in inspect(target).attrs.created_at.history.deleted:
+        invalidate_listing(session, created_at, target.id)
+
+
+@event.listens_for(User, 'after_delete')
+def invalidate_listing_after_delete(mapper, connection, target):
+    revocations.revoke(target.id)
+    invalidate_listing(orm.object_session(target), target.created_at, target.id)
+
+
+@event.listens_for(User, 'after_insert')
+def index_new_user(mapper, connection, target):
+    """Make new usernames and emails visible to availability checks at once"""
+    availability.add(target.username, target.email)
+    replicas.pin(target.id)
+    invalidate_listing(orm.object_session(target), target.created_at, target.id)
+
+
+def invalidate_listing(session, created_at, user_id):
+    """Queue the listing pages around a changed user to be dropped once the change commits"""
+    session.info.setdefault('listing_changes', []).append((created_at, user_id))
+
+
+@event.listens_for(orm.Session, 'after_commit')
+def flush_listing_changes(session):
+    if session.transaction.nested:
+        # a released SAVEPOINT: its changes commit with the outer transaction
+        return
+    for created_at, user_id in session.info.pop('listing_changes', []):
+        listing_cache.invalidate(created_at, user_id)
+
+
+@event.listens_for(orm.Session, 'after_rollback')
+def forget_listing_changes(session):
+    if session.transaction.nested:
+        # the outer transaction may still commit what was queued before the
+        # SAVEPOINT; dropping pages for rows it undid is merely wasteful
+        return
+    session.info.pop('listing_changes', None)
+
+
+class RefreshToken(db.Model):
+    """A single-use token that trades for a new access token without the password
+
+    Only a SHA-256 digest of the token is stored. The token is 256 random
+    bits, so unlike a password it needs no bcrypt to be safe at rest, and
+    checking it is one indexed lookup. Each refresh consumes the token and
+    issues its successor in the same family; a consumed token presented
+    again has leaked, so its whole family is revoked.
+    """
+    __tablename__ = 'refresh_tokens'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'),
+                        nullable=False, index=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    family = db.Column(db.String(32), nullable=False, index=True)
+    used = db.Column(db.Boolean, default=False, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @staticmethod
+    def issue(user_id, family=None):
+        """Adds a new refresh token for user_id to the session - :return: the token"""
+        token = secrets.token_urlsafe(32)
+        db.session.add(RefreshToken(
+            user_id=user_id,
+            token_hash=RefreshToken.digest(token),
+            family=family or uuid.uuid4().hex,
+            expires_at=datetime.datetime.utcnow() + datetime.timedelta(
+                days=current_app.config.get('REFRESH_TOKEN_EXPIRATION_DAYS'))
+        ))
+        return token
+
+    @staticmethod
+    def rotate(token):
+        """Consumes a refresh token and issues its successor - :return: (user, token)|(None, None)
+
+        The caller commits, which also persists a revoked family.
+        """
+        found = db.session.query(RefreshToken, User).join(User, User.id == RefreshToken.user_id) \
+            .filter(RefreshToken.token_hash == RefreshToken.digest(token)).first()
+        if found is None:
+            return None, None
+        refresh, user = found
+        if refresh.used:
+            # replayed: whoever else holds this family has to log in again
+            RefreshToken.query.filter_by(family=refresh.family).delete(synchronize_session=False)
+            return None, None
+        if refresh.expires_at <= datetime.datetime.utcnow() or not user.active:
+            return None, None
+        # only one of two concurrent refreshes with the same token wins
+        consumed = RefreshToken.query.filter_by(id=refresh.id, used=False) \
+            .update({'used': True}, synchronize_session=False)
+        if not consumed:
+            return None, None
+        return user, RefreshToken.issue(user.id, refresh.family)
+
+    @staticmethod
+    def revoke(user_id, token):
+        """Deletes the family of token, ending that one session - :return: how many
+
+        Only user_id's tokens are touched, so nobody can be logged out with
+        a token they do not hold. The caller commits.
+        """
+        family = db.session.query(RefreshToken.family).filter_by(
+            user_id=user_id, token_hash=RefreshToken.digest(token)).scalar()
+        if family is None:
+            return 0
+        return RefreshToken.query.filter_by(user_id=user_id, family=family) \
+            .delete(synchronize_session=False)
+
+    @staticmethod
+    def revoke_all(user_id):
+        """Deletes every refresh token of user_id, ending all of their sessions - :return: how many
+
+        The caller commits.
+        """
+        return RefreshToken.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+
+    @staticmethod
+    def prune():
+        """Deletes expired refresh tokens - :return: how many"""
+        return RefreshToken.query.filter(RefreshToken.expires_at <= datetime.datetime.utcnow()) \
+            .delete(synchronize_session=False)
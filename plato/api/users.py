@@ -1,19 +1,55 @@
-from flask import Blueprint, jsonify, request, make_response
-from sqlalchemy import exc
+import datetime
 
-from plato import db
+from flask import Blueprint, Response, json, request, make_response, current_app, \
+    g, url_for, stream_with_context
+from sqlalchemy import exc, or_, tuple_
+
+from plato import db, hasher, listing_cache, availability, replicas
 from plato.api.models import User
-from plato.api.utils import authenticate, is_admin
+from plato.cache import listing_position
+from plato.serialization import jsonify, dumps
+from plato.hashing import HasherBusy
+from plato.api.utils import authenticate, replica_reads, is_admin, encode_cursor, decode_cursor, \
+    make_etag, is_fresh, not_modified
 
 
 users_blueprint = Blueprint('users', __name__, template_folder='./templates')
 
+# columns a client may select with ?fields=
+USER_FIELDS = ('id', 'username', 'email', 'created_at')
+
+# keys POST /users/lookup accepts -> the column each one matches
+LOOKUP_KEYS = {
+    'ids': 'id',
+    'usernames': 'username',
+    'emails': 'email'
+}
+
+
+def parse_fields(default):
+    '''Return the fields named by ?fields=, or default; raises ValueError on unknown ones'''
+    value = request.args.get('fields')
+    if value is None:
+        return default
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    if not fields or any(field not in USER_FIELDS for field in fields):
+        raise ValueError('Invalid fields')
+    return fields
+
+
+def invalid_fields():
+    response_object = {
+        'status': 'fail',
+        'message': f'Invalid fields. Choose from {", ".join(USER_FIELDS)}.'
+    }
+    return make_response(jsonify(response_object)), 400
+
 
 @users_blueprint.route('/users', methods=['POST'])
 @authenticate
-def add_user(resp):
+def add_user(identity):
     '''Add user info'''
-    if is_admin(resp):
+    if is_admin(identity):
         response_object = {
             'status': 'error',
             'message': 'You do not have permission to do that.'
@@ -30,9 +66,8 @@ def add_user(resp):
     email = post_data.get('email')
     password = post_data.get('password')
     try:
-        user = User.query.filter_by(email=email).first()
-        if not user:
-            db.session.add(User(username=username, email=email, password=password))
+        user_id, conflict = User.create(username=username, email=email, password=password)
+        if not conflict:
             db.session.commit()
             response_object = {
                 'status': 'success',
@@ -42,7 +77,7 @@ def add_user(resp):
         else:
             response_object = {
                 'status': 'fail',
-                'message': 'Sorry, that email already exists.'
+                'message': f'Sorry, that {conflict} already exists.'
             }
             return make_response(jsonify(response_object)), 400
     except exc.IntegrityError as e:
@@ -59,9 +94,123 @@ def add_user(resp):
             'message': 'Invalid payload.'
         }
         return make_response(jsonify(response_object)), 400
+    except HasherBusy:
+        db.session().rollback()
+        response_object = {
+            'status': 'error',
+            'message': 'Server is busy. Please try again later.'
+        }
+        return make_response(jsonify(response_object)), 503
+
+
+@users_blueprint.route('/users/bulk', methods=['POST'])
+@authenticate
+def add_users_bulk(identity):
+    '''Add many users from a JSON array or an NDJSON body'''
+    if not is_admin(identity):
+        response_object = {
+            'status': 'error',
+            'message': 'You do not have permission to do that.'
+        }
+        return make_response(jsonify(response_object)), 403
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            lines = request.get_data(as_text=True).splitlines()
+            rows = [json.loads(line) for line in lines if line.strip()]
+        else:
+            rows = request.get_json()
+    except ValueError:
+        rows = None
+    if not rows or not isinstance(rows, list):
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid payload.'
+        }
+        return make_response(jsonify(response_object)), 400
+    if len(rows) > current_app.config.get('USERS_BULK_MAX_ROWS'):
+        response_object = {
+            'status': 'fail',
+            'message': 'Too many users in one request.'
+        }
+        return make_response(jsonify(response_object)), 400
+
+    results = [{'index': index, 'status': 'fail'} for index in range(len(rows))]
+    candidates = []
+    usernames, emails = set(), set()
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict) or \
+                not all(isinstance(row.get(key), str) and row.get(key)
+                        for key in ('username', 'email', 'password')):
+            results[index]['message'] = 'Invalid payload.'
+        elif row['username'] in usernames or row['email'] in emails:
+            results[index]['message'] = 'Duplicate user in request.'
+        else:
+            usernames.add(row['username'])
+            emails.add(row['email'])
+            candidates.append(index)
+
+    # one set-based lookup per batch instead of a SELECT per user
+    batch_size = current_app.config.get('USERS_BULK_BATCH_SIZE')
+    taken_usernames, taken_emails = set(), set()
+    for start in range(0, len(candidates), batch_size):
+        batch = [rows[index] for index in candidates[start:start + batch_size]]
+        existing = db.session.query(User.username, User.email).filter(or_(
+            User.username.in_([row['username'] for row in batch]),
+            User.email.in_([row['email'] for row in batch])
+        ))
+        for username, email in existing:
+            taken_usernames.add(username)
+            taken_emails.add(email)
+    # hashing can take minutes: do not sit idle in a transaction meanwhile
+    db.session.commit()
+    new_users = []
+    for index in candidates:
+        if rows[index]['username'] in taken_usernames or rows[index]['email'] in taken_emails:
+            results[index]['message'] = 'Sorry, that user already exists.'
+        else:
+            new_users.append(index)
+
+    pw_hashes = hasher.generate_password_hashes(
+        [rows[index]['password'] for index in new_users],
+        current_app.config.get('BCRYPT_LOG_ROUNDS')
+    )
+    created_at = datetime.datetime.now()
+    values = [{
+        'username': rows[index]['username'],
+        'email': rows[index]['email'],
+        'password': pw_hash.decode(),
+        'active': True,
+        'admin': False,
+        'created_at': created_at
+    } for index, pw_hash in zip(new_users, pw_hashes)]
+    # users added concurrently since the lookup are skipped, not fatal
+    inserted = set()
+    for start in range(0, len(values), batch_size):
+        inserted |= User.insert_many(values[start:start + batch_size])
+    db.session.commit()
+    # the inserts return no ids to place the new rows with, so start afresh
+    listing_cache.clear()
+    for index in new_users:
+        if rows[index]['username'] not in inserted:
+            results[index]['message'] = 'Sorry, that user already exists.'
+            continue
+        availability.add(rows[index]['username'], rows[index]['email'])
+        results[index]['status'] = 'success'
+        results[index]['message'] = f'{rows[index]["email"]} was added!'
+
+    response_object = {
+        'status': 'success',
+        'data': {
+            'created': len(inserted),
+            'failed': len(rows) - len(inserted),
+            'results': results
+        }
+    }
+    return make_response(jsonify(response_object)), 200
 
 
 @users_blueprint.route('/users/<user_id>', methods=['GET'])
+@replica_reads
 def get_user(user_id):
     '''Get single userinfo'''
     response_object = {
@@ -69,41 +218,244 @@ def get_user(user_id):
         'message': 'User does not exist.'
     }
     try:
-        user = User.query.filter_by(id=int(user_id)).first()
+        fields = parse_fields(('username', 'email', 'created_at'))
+    except ValueError:
+        return invalid_fields()
+    try:
+        replicas.prefer_primary_for(int(user_id))
+        if request.if_none_match:
+            # answer revalidations from the version alone, without loading the row
+            version = db.session.query(User.version).filter(User.id == int(user_id)).scalar()
+            etag = make_etag('user', int(user_id), version, *fields)
+            if version is not None and is_fresh(etag):
+                return not_modified(etag)
+        # select only the requested columns, as plain rows rather than User objects
+        user = db.session.query(User.version, *(getattr(User, field) for field in fields)) \
+            .filter(User.id == int(user_id)).first()
         if not user:
             return make_response(jsonify(response_object)), 404
         else:
             response_object = {
                 'status': 'success',
-                'data': {
-                    'username': user.username,
-                    'email': user.email,
-                    'created_at': user.created_at
-                }
+                'data': {field: getattr(user, field) for field in fields}
             }
-            return make_response(jsonify(response_object)), 200
+            response = make_response(jsonify(response_object))
+            response.set_etag(make_etag('user', int(user_id), user.version, *fields))
+            return response, 200
     except ValueError:
         return make_response(jsonify(response_object)), 404
 
 
+@users_blueprint.route('/users/lookup', methods=['POST'])
+@replica_reads
+def lookup_users():
+    '''Resolve many users at once by id, username and/or email'''
+    try:
+        fields = parse_fields(USER_FIELDS)
+    except ValueError:
+        return invalid_fields()
+    post_data = request.get_json(silent=True)
+    try:
+        if not isinstance(post_data, dict):
+            raise ValueError('Invalid payload')
+        keys = {key: post_data.get(key) or [] for key in LOOKUP_KEYS}
+        if not any(keys.values()) or not all(isinstance(values, list) for values in keys.values()):
+            raise ValueError('Invalid payload')
+        keys['ids'] = [int(user_id) for user_id in keys['ids']]
+        if not all(isinstance(value, str) for value in keys['usernames'] + keys['emails']):
+            raise ValueError('Invalid payload')
+    except (TypeError, ValueError):
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid payload.'
+        }
+        return make_response(jsonify(response_object)), 400
+    if sum(len(values) for values in keys.values()) > \
+            current_app.config.get('USERS_LOOKUP_MAX_KEYS'):
+        return too_many_keys()
+    found, missing = resolve_users(keys, fields)
+    response_object = {
+        'status': 'success',
+        'data': dict(found, missing=missing)
+    }
+    return make_response(jsonify(response_object)), 200
+
+
+def resolve_users(keys, fields):
+    '''Look up every id/username/email in keys with a single IN query
+
+    Returns the matches keyed by input value under each request key, and
+    the values nothing matched.
+    '''
+    for user_id in keys.get('ids', ()):
+        replicas.prefer_primary_for(user_id)
+    columns = dict.fromkeys(fields + tuple(LOOKUP_KEYS[key] for key in keys if keys[key]))
+    users = db.session.query(*(getattr(User, column) for column in columns)).filter(or_(*(
+        getattr(User, LOOKUP_KEYS[key]).in_(values) for key, values in keys.items() if values
+    ))).all()
+    found, missing = {}, {}
+    for key, values in keys.items():
+        column = LOOKUP_KEYS[key]
+        by_value = {getattr(user, column): user for user in users}
+        found[key] = {
+            str(value): {field: getattr(by_value[value], field) for field in fields}
+            for value in values if value in by_value
+        }
+        missing[key] = [value for value in dict.fromkeys(values) if value not in by_value]
+    return found, missing
+
+
+def too_many_keys():
+    response_object = {
+        'status': 'fail',
+        'message': 'Too many users in one lookup.'
+    }
+    return make_response(jsonify(response_object)), 400
+
+
 @users_blueprint.route('/users', methods=['GET'])
+@replica_reads
 def get_all_users():
-    '''Get all user info'''
-    users = User.query.order_by(User.created_at.desc()).all()
-    users_list = []
-    for user in users:
-        user_object = {
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'created_at': user.created_at
-        }
-        users_list.append(user_object)
+    '''Get a page of user info, newest first, using keyset pagination'''
+    try:
+        fields = parse_fields(USER_FIELDS)
+    except ValueError:
+        return invalid_fields()
+    if 'ids' in request.args:
+        return get_users_by_id(fields)
+    stream = request.args.get('stream')
+    if stream == 'ndjson':
+        return stream_all_users(fields)
+    elif stream is not None:
+        response_object = {
+            'status': 'fail',
+            'message': 'Unsupported stream format.'
+        }
+        return make_response(jsonify(response_object)), 400
+    try:
+        limit = int(request.args.get('limit', current_app.config.get('USERS_PER_PAGE')))
+        if limit < 1 or limit > current_app.config.get('USERS_MAX_PER_PAGE'):
+            raise ValueError('Invalid limit')
+        cursor = request.args.get('cursor')
+        # the requested columns plus what the cursor, ETag and cache need
+        columns = dict.fromkeys(fields + ('id', 'created_at', 'version'))
+        query = db.session.query(*(getattr(User, column) for column in columns)) \
+            .order_by(User.created_at.desc(), User.id.desc())
+        high = None
+        if cursor:
+            created_at, user_id = decode_cursor(cursor)
+            query = query.filter(tuple_(User.created_at, User.id) < tuple_(created_at, user_id))
+            high = listing_position(created_at, user_id)
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid pagination parameters.'
+        }
+        return make_response(jsonify(response_object)), 400
+
+    cache_key = f'{limit}|{cursor or ""}|{",".join(fields)}'
+    entry = listing_cache.get(cache_key)
+    if entry is not None:
+        if is_fresh(entry['etag']):
+            return not_modified(entry['etag'])
+        return cached_page(entry), 200
+
+    # fetch one extra row to find out whether there is a next page
+    query = query.limit(limit + 1)
+    if request.if_none_match:
+        # the page's ids and versions identify its content, so probe just those
+        etag = page_etag(limit, fields, query.with_entities(User.id, User.version))
+        if is_fresh(etag):
+            return not_modified(etag)
+    users = query.all()
+    users_list = [{field: getattr(user, field) for field in fields} for user in users[:limit]]
+
+    next_cursor = None
+    next_link = None
+    if len(users) > limit:
+        last = users[limit - 1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+        next_link = url_for('users.get_all_users', limit=limit, cursor=next_cursor,
+                            fields=request.args.get('fields'))
 
     response_object = {
         'status': 'success',
         'data': {
-            'users': users_list
+            'users': users_list,
+            'next_cursor': next_cursor
+        },
+        'links': {
+            'next': next_link
+        }
+    }
+    response = make_response(jsonify(response_object))
+    if next_link:
+        response.headers['Link'] = f'<{next_link}>; rel="next"'
+    response.set_etag(page_etag(limit, fields, users))
+    # the page shows everything from its cursor down to the look-ahead row
+    low = listing_position(users[limit].created_at, users[limit].id) \
+        if len(users) > limit else None
+    # a lagging replica could put back a page that a write has just
+    # invalidated, so only pages read from the primary are cached
+    if g.get('replica') is None or g.get('primary_only'):
+        listing_cache.set(cache_key, {
+            'low': low,
+            'high': high,
+            'body': response.get_data(as_text=True),
+            'etag': response.get_etag()[0],
+            'link': response.headers.get('Link')
+        })
+    return response, 200
+
+
+def get_users_by_id(fields):
+    '''GET /users?ids=1,2,3: the users with those ids, keyed by id'''
+    try:
+        ids = [int(user_id) for user_id in request.args.get('ids').split(',') if user_id.strip()]
+        if not ids:
+            raise ValueError('No ids')
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid ids.'
+        }
+        return make_response(jsonify(response_object)), 400
+    if len(ids) > current_app.config.get('USERS_LOOKUP_MAX_KEYS'):
+        return too_many_keys()
+    found, missing = resolve_users({'ids': ids}, fields)
+    response_object = {
+        'status': 'success',
+        'data': {
+            'users': found['ids'],
+            'missing': missing['ids']
         }
     }
     return make_response(jsonify(response_object)), 200
+
+
+def cached_page(entry):
+    response = current_app.response_class(entry['body'], mimetype='application/json')
+    if entry['link']:
+        response.headers['Link'] = entry['link']
+    response.set_etag(entry['etag'])
+    return response
+
+
+def page_etag(limit, fields, rows):
+    '''ETag of a listing page from the (id, version) of its rows, extra row included'''
+    return make_etag('users', limit, ','.join(fields),
+                     *(f'{row.id}:{row.version}' for row in rows))
+
+
+def stream_all_users(fields=USER_FIELDS):
+    '''Stream every user as newline delimited JSON from a server-side cursor'''
+    query = db.session.query(*(getattr(User, field) for field in fields)) \
+        .order_by(User.created_at.desc(), User.id.desc()) \
+        .execution_options(stream_results=True) \
+        .yield_per(current_app.config.get('USERS_STREAM_BATCH_SIZE'))
+
+    def generate():
+        for user in query:
+            yield dumps(dict(zip(fields, user)), indent=False) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
@@ -1,11 +1,30 @@
+import base64
+import binascii
+import datetime
+import hashlib
+from collections import namedtuple
 from functools import wraps
 
-from flask import request, make_response, jsonify
+from flask import g, request, make_response, current_app
 
+from plato import token_cache, replicas, revocations, denylist
 from plato.api.models import User
+from plato.serialization import jsonify
+
+
+# what a verified auth token resolves to; cached per token by authenticate.
+# issued_at is only set when the flags came from the token's own claims.
+Identity = namedtuple('Identity', ['id', 'active', 'admin', 'issued_at', 'jti', 'expires_at'])
 
 
 def authenticate(f):
+    '''Resolve the bearer token to an Identity and pass it to the view
+
+    Tokens carrying active/admin claims are trusted as they are while
+    TOKEN_CLAIMS is set, unless the user's tokens were revoked since; any
+    other token is checked against the user's row. Logged out tokens are
+    refused through the denylist.
+    '''
     @wraps(f)
     def decorated_function(*args, **kwargs):
         response_object = {
@@ -19,19 +38,89 @@ def authenticate(f):
             code = 403
             return make_response(jsonify(response_object)), code
         auth_token = auth_header.split(' ')[1]
-        resp = User.decode_auth_token(auth_token)
-        if isinstance(resp, str):
-            response_object['message'] = resp
+        g.pop('current_user', None)
+        identity = token_cache.get(auth_token)
+        if identity is None:
+            payload = User.decode_auth_payload(auth_token)
+            if isinstance(payload, str):
+                response_object['message'] = payload
+                return make_response(jsonify(response_object)), code
+            if current_app.config.get('TOKEN_CLAIMS') and 'active' in payload:
+                identity = Identity(payload['sub'], payload['active'], payload['admin'],
+                                    payload['iat'], payload.get('jti'), payload['exp'])
+            else:
+                replicas.prefer_primary_for(payload['sub'], payload['iat'])
+                user = User.query.filter_by(id=payload['sub']).first()
+                if not user:
+                    return make_response(jsonify(response_object)), code
+                g.current_user = user
+                identity = Identity(user.id, user.active, user.admin, None,
+                                    payload.get('jti'), payload['exp'])
+            token_cache.set(auth_token, identity, payload['exp'])
+        if identity.jti in denylist:
+            response_object['message'] = 'Token revoked. Please log in again.'
             return make_response(jsonify(response_object)), code
-        user = User.query.filter_by(id=resp).first()
-        if not user or not user.active:
+        if not identity.active or identity.issued_at is not None and \
+                revocations.is_revoked(identity.id, identity.issued_at):
             return make_response(jsonify(response_object)), code
-        return f(resp, *args, **kwargs)
+        g.identity = identity
+        replicas.prefer_primary_for(identity.id)
+        return f(identity, *args, **kwargs)
     return decorated_function
 
 
-def is_admin(user_id):
-    user = User.query.filter_by(id=user_id).first()
+def replica_reads(f):
+    '''Let a read-only view query a read replica instead of the primary'''
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.replica = replicas.choose()
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def get_current_user():
+    '''Return the authenticated User, loading it at most once per request'''
+    if 'current_user' not in g:
+        g.current_user = User.query.filter_by(id=g.identity.id).first()
+    return g.current_user
+
+
+def is_admin(user):
     if user.admin:
         return True
     return False
+
+
+def make_etag(*parts):
+    '''Derive a strong ETag from the values that determine a representation'''
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def is_fresh(etag):
+    '''Whether the client's If-None-Match already names etag'''
+    return request.if_none_match.contains_weak(etag)
+
+
+def not_modified(etag):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    return response
+
+
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(created_at, user_id):
+    '''Encode a (created_at, id) keyset position as an opaque cursor'''
+    raw = f'{created_at.strftime(CURSOR_DATETIME_FORMAT)}|{user_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    '''Decode a cursor into (created_at, id), raising ValueError if malformed'''
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, user_id = raw.split('|')
+        return datetime.datetime.strptime(created_at, CURSOR_DATETIME_FORMAT), int(user_id)
+    except (TypeError, UnicodeError, binascii.Error) as e:
+        raise ValueError('Invalid cursor') from e
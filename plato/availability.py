@@ -0,0 +1,169 @@
+import hashlib
+import math
+import threading
+import time
+
+from flask import current_app
+
+
+class BloomFilter:
+    '''A fixed-size Bloom filter over strings'''
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def _positions(self, key):
+        # double hashing: k positions from two halves of one digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+
+class AvailabilityIndex:
+    '''Bloom filters over every username and email in the users table
+
+    A miss means the value is free, so only possible hits need the
+    database. The filters are built on first use. Every
+    AVAILABILITY_SYNC_INTERVAL seconds they pull in rows inserted by other
+    processes; inserts made here are added straight away. Ids are handed
+    out before transactions commit, so a row can show up below the highest
+    id already seen: each sync re-reads the last AVAILABILITY_SYNC_OVERLAP
+    ids, and the filters are rebuilt every AVAILABILITY_REBUILD_INTERVAL
+    seconds to catch anything later still. Rebuilds, and the ones needed
+    once the filters fill up, run in a background thread while requests
+    keep using the old filters.
+    '''
+
+    FIELDS = ('username', 'email')
+
+    def __init__(self, app=None):
+        self.sync_interval = 5
+        self.error_rate = 0.01
+        self.min_capacity = 100000
+        self.sync_overlap = 1000
+        self.rebuild_interval = 3600
+        self._filters = None
+        self._max_id = 0
+        self._synced_at = 0
+        self._built_at = 0
+        self._generation = 0
+        self._rebuilder = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.sync_interval = app.config.get('AVAILABILITY_SYNC_INTERVAL', 5)
+        self.error_rate = app.config.get('AVAILABILITY_ERROR_RATE', 0.01)
+        self.min_capacity = app.config.get('AVAILABILITY_MIN_CAPACITY', 100000)
+        self.sync_overlap = app.config.get('AVAILABILITY_SYNC_OVERLAP', 1000)
+        self.rebuild_interval = app.config.get('AVAILABILITY_REBUILD_INTERVAL', 3600)
+
+    def might_exist(self, field, value):
+        self.sync()
+        return value in self._filters[field]
+
+    def add(self, username, email):
+        filters = self._filters
+        if filters is not None:
+            filters['username'].add(username)
+            filters['email'].add(email)
+
+    def build(self):
+        with self._lock:
+            self._build()
+
+    def sync(self):
+        '''Build the filters, or catch up with rows inserted since the last sync'''
+        from plato import db
+        from plato.api.models import User
+        if self._filters is not None and time.time() - self._synced_at < self.sync_interval:
+            return
+        with self._lock:
+            # another thread may have built or synced while this one waited
+            if self._filters is None:
+                return self._build()
+            if time.time() - self._built_at >= self.rebuild_interval:
+                self._rebuild_in_background()
+            if time.time() - self._synced_at < self.sync_interval:
+                return
+            rows = db.session.query(User.id, User.username, User.email) \
+                .filter(User.id > self._max_id - self.sync_overlap).all()
+            filters = self._filters
+            for user_id, username, email in rows:
+                # rows in the overlap were mostly seen before; do not count them twice
+                if username not in filters['username']:
+                    filters['username'].add(username)
+                if email not in filters['email']:
+                    filters['email'].add(email)
+                self._max_id = max(self._max_id, user_id)
+            self._synced_at = time.time()
+            if filters['username'].count > filters['username'].capacity:
+                self._rebuild_in_background()
+
+    def reset(self):
+        with self._lock:
+            self._generation += 1
+            self._filters = None
+            self._max_id = 0
+            self._synced_at = 0
+            self._built_at = 0
+
+    def _build(self):
+        self._filters, self._max_id = self._load()
+        self._synced_at = self._built_at = time.time()
+
+    def _rebuild_in_background(self):
+        '''Start building fresh filters, unless that is already under way'''
+        if self._rebuilder is not None and self._rebuilder.is_alive():
+            return
+        self._rebuilder = threading.Thread(
+            target=self._rebuild, args=(current_app._get_current_object(), self._generation),
+            daemon=True)
+        self._rebuilder.start()
+
+    def _rebuild(self, app, generation):
+        from plato import db
+        with app.app_context():
+            try:
+                filters, max_id = self._load()
+            finally:
+                db.session.remove()
+        with self._lock:
+            if generation != self._generation:
+                # reset while this was building
+                return
+            self._filters, self._max_id = filters, max_id
+            self._built_at = time.time()
+            # catch up right away with rows committed while this was building
+            self._synced_at = 0
+
+    def _load(self):
+        '''Read every username and email into new filters - :return: (filters, max id)'''
+        from plato import db
+        from plato.api.models import User
+        count = db.session.query(db.func.count(User.id)).scalar()
+        capacity = max(count * 2, self.min_capacity)
+        filters = {field: BloomFilter(capacity, self.error_rate) for field in self.FIELDS}
+        rows = db.session.query(User.id, User.username, User.email) \
+            .execution_options(stream_results=True).yield_per(10000)
+        max_id = 0
+        for user_id, username, email in rows:
+            filters['username'].add(username)
+            filters['email'].add(email)
+            max_id = max(max_id, user_id)
+        return filters, max_id
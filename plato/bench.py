@@ -0,0 +1,225 @@
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import json as flask_json
+
+from plato import db
+from plato.api.models import User
+from plato.seed import generate_users, seed_users, SEED_PASSWORD
+from plato.serialization import JSONProvider, orjson
+
+
+DEFAULT_MIX = 'login=1,status=10,users=5,user=20'
+
+
+def parse_mix(mix):
+    '''Parse "name=weight,..." into a dict of endpoint weights'''
+    weights = {}
+    for part in mix.split(','):
+        name, weight = part.split('=')
+        if name.strip() not in ENDPOINTS:
+            raise ValueError(f'Unknown endpoint {name!r}')
+        weights[name.strip()] = int(weight)
+    return weights
+
+
+def percentile(values, p):
+    '''Nearest-rank percentile of an already sorted list'''
+    if not values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(values)) - 1, 0)
+    return values[rank]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    '''List every endpoint whose p95 or throughput is worse than baseline'''
+    regressions = []
+    for name, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(
+                f'{name}: p95 {current["p95_ms"]:.2f} ms > {previous["p95_ms"]:.2f} ms')
+        if current['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append(
+                f'{name}: throughput {current["throughput"]:.1f}/s < {previous["throughput"]:.1f}/s')
+    return regressions
+
+
+def _login(client, context):
+    return client.post(
+        '/auth/login',
+        data=json.dumps(dict(email=context['email'], password=SEED_PASSWORD)),
+        content_type='application/json'
+    )
+
+
+def _status(client, context):
+    return client.get('/auth/status', headers=dict(Authorization='Bearer ' + context['token']))
+
+
+def _users(client, context):
+    return client.get('/users')
+
+
+def _user(client, context):
+    return client.get(f'/users/{context["rng"].choice(context["ids"])}')
+
+
+ENDPOINTS = {
+    'login': _login,
+    'status': _status,
+    'users': _users,
+    'user': _user
+}
+
+
+@contextmanager
+def bench_database(app, database_url=None):
+    '''Point app at database_url, or at a throwaway SQLite file, for the block
+
+    The benchmark creates tables and seeds users, some of them admins with
+    a known password, so it never touches the configured database unless
+    that is asked for by URL.
+    '''
+    configured = app.config['SQLALCHEMY_DATABASE_URI']
+    tmpdir = None
+    if database_url is None:
+        tmpdir = tempfile.mkdtemp(prefix='plato-bench-')
+        database_url = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+    with app.app_context():
+        # a session still in a transaction would keep using the old engine
+        db.session.remove()
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    try:
+        yield database_url
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.get_engine(app).dispose()
+        app.config['SQLALCHEMY_DATABASE_URI'] = configured
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def prepare(app, users):
+    '''Make sure at least `users` seeded users exist and log one of them in'''
+    with app.app_context():
+        db.create_all()
+        existing = User.query.filter(User.email.like('user%@example.com')).count()
+        if existing < users:
+            seed_users(users - existing)
+        ids = [user_id for user_id, in db.session.query(User.id).limit(10000)]
+        email = db.session.query(User.email) \
+            .filter(User.email.like('user%@example.com'), User.active.is_(True)) \
+            .order_by(User.id).limit(1).scalar()
+    response = _login(app.test_client(), {'email': email})
+    token = json.loads(response.data.decode())['auth_token']
+    return {'email': email, 'token': token, 'ids': ids}
+
+
+def run_benchmark(app, requests=1000, concurrency=4, mix=DEFAULT_MIX, users=1000, seed=0):
+    '''Drive the endpoints in `mix` from `concurrency` threads and time them'''
+    weights = parse_mix(mix)
+    context = prepare(app, users)
+    names = list(weights)
+    rng = random.Random(seed)
+    plan = rng.choices(names, weights=[weights[name] for name in names], k=requests)
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def call(name):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+            local.context = dict(context, rng=random.Random(rng.random()))
+        started_at = time.perf_counter()
+        response = ENDPOINTS[name](local.client, local.context)
+        elapsed = time.perf_counter() - started_at
+        with lock:
+            latencies[name].append(elapsed)
+            if response.status_code >= 400:
+                errors[name] += 1
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, plan))
+    elapsed = time.perf_counter() - started_at
+
+    return {
+        'config': {
+            'requests': requests,
+            'concurrency': concurrency,
+            'mix': weights,
+            'users': users,
+            'database': app.config.get('SQLALCHEMY_DATABASE_URI').split(':')[0]
+        },
+        'endpoints': {
+            name: summarize(latencies[name], errors[name], elapsed) for name in names
+        },
+        'total': summarize(
+            [latency for name in names for latency in latencies[name]],
+            sum(errors.values()),
+            elapsed
+        )
+    }
+
+
+def json_benchmark(users=10000, repeat=5):
+    '''Time serializing a GET /users payload of `users` rows with each JSON backend
+
+    'flask' is what views used before JSONProvider: Flask's encoder with
+    sorted keys, pretty-printing and RFC 1123 dates. Returns the best
+    time and the size of the output for every backend.
+    '''
+    payload = {
+        'status': 'success',
+        'data': {
+            'users': [
+                {'id': n, 'username': username, 'email': email, 'created_at': created_at}
+                for n, (username, email, _, _, _, created_at) in enumerate(generate_users(users))
+            ],
+            'next_cursor': None
+        },
+        'links': {'next': None}
+    }
+    encoders = {
+        'flask': lambda: flask_json.dumps(
+            payload, indent=2, separators=(', ', ': '), sort_keys=True).encode('utf-8')
+    }
+    backends = ['stdlib'] + (['orjson'] if orjson is not None else [])
+    for backend in backends:
+        provider = JSONProvider()
+        provider.backend = backend
+        encoders[backend] = lambda provider=provider: provider.dumps(payload)
+    results = {}
+    for name, encode in encoders.items():
+        timings = []
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            body = encode()
+            timings.append(time.perf_counter() - started_at)
+        results[name] = {'ms': min(timings) * 1000, 'bytes': len(body)}
+    return results
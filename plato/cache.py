@@ -0,0 +1,225 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    '''A bounded, thread-safe LRU cache whose entries expire'''
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] <= time.time():
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, expires_at=None):
+        '''Store value until now + ttl, or until expires_at if that is sooner'''
+        now = time.time()
+        deadline = now + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        if self.maxsize <= 0 or deadline <= now:
+            return
+        with self._lock:
+            self._data[key] = (value, deadline)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        '''Drop every entry whose value matches predicate'''
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(value)]:
+                del self._data[key]
+
+    def clear(self):
+        '''Drop every entry; hits and misses keep counting, as /metrics exports them as totals'''
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize
+        }
+
+
+class TokenCache(TTLCache):
+    '''Caches verified auth tokens and the identity they resolve to
+
+    The cache is per process: invalidate_user only reaches the worker that
+    made the change, and the others keep their entries for up to
+    TOKEN_CACHE_TTL seconds.
+    '''
+
+    def __init__(self, app=None):
+        super().__init__(maxsize=0, ttl=0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config.get('TOKEN_CACHE_SIZE', 0)
+        self.ttl = app.config.get('TOKEN_CACHE_TTL', 0)
+
+    def invalidate_user(self, user_id):
+        '''Forget every cached token that resolved to user_id'''
+        self.delete_where(lambda identity: identity.id == user_id)
+
+
+class RedisCache:
+    '''The TTLCache interface on top of Redis, for a cache shared between processes
+
+    Values are stored as JSON, each under its own key with the TTL set
+    in Redis. A sorted set of last-access times caps the cache at maxsize
+    entries by evicting the least recently used ones.
+    '''
+
+    def __init__(self, url, prefix, maxsize=1024, ttl=60):
+        import redis
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._index = prefix + 'index'
+        self._redis = redis.StrictRedis.from_url(url)
+
+    def __len__(self):
+        return self._redis.zcard(self._index)
+
+    def get(self, key):
+        raw = self._redis.get(self.prefix + key)
+        if raw is None:
+            self._redis.zrem(self._index, key)
+            self.misses += 1
+            return None
+        self._redis.zadd(self._index, {key: time.time()})
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, expires_at=None):
+        now = time.time()
+        ttl = self.ttl if expires_at is None else min(self.ttl, expires_at - now)
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        pipe = self._redis.pipeline()
+        pipe.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+        pipe.zadd(self._index, {key: now})
+        pipe.zcard(self._index)
+        size = pipe.execute()[-1]
+        if size > self.maxsize:
+            self._delete(self._redis.zrange(self._index, 0, size - self.maxsize - 1))
+
+    def delete(self, key):
+        self._delete([key])
+
+    def delete_where(self, predicate):
+        keys = self._redis.zrange(self._index, 0, -1)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            values = self._redis.mget([self.prefix + self._decode(key) for key in chunk])
+            self._delete([key for key, raw in zip(chunk, values)
+                          if raw is None or predicate(json.loads(raw))])
+
+    def clear(self):
+        self._delete(self._redis.zrange(self._index, 0, -1))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self),
+            'maxsize': self.maxsize
+        }
+
+    def _delete(self, keys):
+        keys = [self._decode(key) for key in keys]
+        if keys:
+            pipe = self._redis.pipeline()
+            pipe.delete(*[self.prefix + key for key in keys])
+            pipe.zrem(self._index, *keys)
+            pipe.execute()
+
+    @staticmethod
+    def _decode(key):
+        return key.decode() if isinstance(key, bytes) else key
+
+
+def listing_position(created_at, user_id):
+    '''A user's place in the newest-first listing, comparable and JSON-safe'''
+    return [created_at.strftime('%Y-%m-%dT%H:%M:%S.%f'), user_id]
+
+
+class ListingCache:
+    '''Caches rendered pages of GET /users, keyed by their query parameters
+
+    Each entry remembers the slice of the listing it shows: from its
+    cursor down to its look-ahead row, or to the end of the listing. A
+    change to a user drops exactly the pages whose slice holds that user's
+    position. Entries live in this process unless USERS_CACHE_URL names
+    a Redis server to share them between workers. An in-process cache
+    only sees this process's writes, so other workers' changes show up
+    once USERS_CACHE_TTL runs out.
+    '''
+
+    def __init__(self, app=None):
+        self.backend = TTLCache(maxsize=0, ttl=0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        maxsize = app.config.get('USERS_CACHE_SIZE', 0)
+        ttl = app.config.get('USERS_CACHE_TTL', 0)
+        url = app.config.get('USERS_CACHE_URL')
+        if url:
+            self.backend = RedisCache(url, 'plato:users:', maxsize, ttl)
+        else:
+            self.backend = TTLCache(maxsize, ttl)
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, entry):
+        '''Store entry, a dict with the rendered page and its low/high positions'''
+        self.backend.set(key, entry)
+
+    def invalidate(self, created_at, user_id):
+        '''Drop every cached page whose slice includes this user's position'''
+        position = listing_position(created_at, user_id)
+
+        def covers(entry):
+            return (entry['low'] is None or entry['low'] <= position) and \
+                (entry['high'] is None or position < entry['high'])
+
+        self.backend.delete_where(covers)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats()
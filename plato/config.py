@@ -1,21 +1,117 @@
 import os
 
+
+CPU_COUNT = os.cpu_count() or 1
+GUNICORN_WORKERS = int(os.getenv('GUNICORN_WORKERS', 2 * CPU_COUNT + 1))
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 4))
+GUNICORN_TIMEOUT = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+
+def replica_binds(urls):
+    '''Map a comma separated list of replica URLs to SQLALCHEMY_BINDS keys'''
+    return {f'replica_{n}': url for n, url in enumerate(u for u in urls.split(',') if u)}
+
 class BaseConfig:
     '''Base Configuration'''
     DEBUG = False
     TESTING = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # per worker process, which never runs more than GUNICORN_THREADS requests
+    # at once; the whole host opens up to GUNICORN_WORKERS times as many
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.getenv('DATABASE_POOL_SIZE', GUNICORN_THREADS)),
+        'max_overflow': int(os.getenv('DATABASE_MAX_OVERFLOW', 0)),
+        'pool_timeout': int(os.getenv('DATABASE_POOL_TIMEOUT', 5)),
+        'pool_recycle': int(os.getenv('DATABASE_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True
+    }
+    DATABASE_PGBOUNCER = os.getenv('DATABASE_PGBOUNCER') == 'true'
+    JSON_BACKEND = os.getenv('JSON_BACKEND', 'orjson')
+    JSON_DATETIME_FORMAT = os.getenv('JSON_DATETIME_FORMAT', 'http')
+    JSON_SORT_KEYS = False
+    JSONIFY_PRETTYPRINT_REGULAR = False
     SECRET_KEY = os.environ.get('SECRET_KEY')
-    BCRYPT_LOG_ROUNDS = 13
-    TOKEN_EXPIRATION_DAYS = 30
-    TOKEN_EXPIRATION_SECONDS = 0
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 13))
+    # hashes running at once across every gunicorn worker on the host
+    BCRYPT_HOST_CONCURRENCY = int(os.getenv('BCRYPT_HOST_CONCURRENCY', CPU_COUNT))
+    # per worker process: its share of the host's cores, rounded up, and room
+    # for every other request thread to wait; the host slots do the limiting
+    BCRYPT_POOL_SIZE = int(os.getenv('BCRYPT_POOL_SIZE', -(-CPU_COUNT // GUNICORN_WORKERS)))
+    BCRYPT_QUEUE_DEPTH = int(os.getenv('BCRYPT_QUEUE_DEPTH',
+                                       max(0, GUNICORN_THREADS - BCRYPT_POOL_SIZE)))
+    # how long a login waits for a host slot before the answer is 503
+    BCRYPT_QUEUE_TIMEOUT = float(os.getenv('BCRYPT_QUEUE_TIMEOUT', 5))
+    # a bulk import starts this many processes of its own for the request
+    BCRYPT_BULK_POOL_SIZE = int(os.getenv('BCRYPT_BULK_POOL_SIZE', CPU_COUNT))
+    # roughly what one hash at BCRYPT_LOG_ROUNDS takes; see manage.py calibrate_bcrypt
+    BCRYPT_HASH_SECONDS = float(os.getenv('BCRYPT_HASH_SECONDS', 0.25))
+    # access tokens are short-lived; clients renew them at /auth/refresh
+    TOKEN_EXPIRATION_DAYS = 0
+    TOKEN_EXPIRATION_SECONDS = 900
+    REFRESH_TOKEN_EXPIRATION_DAYS = 30
+    # embed active/admin in tokens and trust them for TOKEN_CLAIMS_MAX_AGE seconds
+    TOKEN_CLAIMS = os.getenv('TOKEN_CLAIMS') == 'true'
+    TOKEN_CLAIMS_MAX_AGE = int(os.getenv('TOKEN_CLAIMS_MAX_AGE', 300))
+    # a redis:// URL shares revocations between workers, required by TOKEN_CLAIMS;
+    # needs the redis package
+    TOKEN_REVOCATION_URL = os.getenv('TOKEN_REVOCATION_URL')
+    TOKEN_REVOCATION_SIZE = 100000
+    # logged-out tokens are appended here so the denylist survives restarts
+    # and is shared between workers; required with several workers outside
+    # debug and testing. Use a directory only the app can write to, on
+    # storage every host behind the load balancer mounts
+    TOKEN_DENYLIST_FILE = os.getenv('TOKEN_DENYLIST_FILE')
+    TOKEN_DENYLIST_SYNC_INTERVAL = 1
+    # sign tokens with the <JWT_KEY_ID>.pem key pair in this directory instead of SECRET_KEY
+    JWT_KEYS_DIR = os.getenv('JWT_KEYS_DIR')
+    JWT_KEY_ID = os.getenv('JWT_KEY_ID')
+    # while switching to key pairs, keep accepting tokens signed with SECRET_KEY
+    JWT_ACCEPT_HS256 = os.getenv('JWT_ACCEPT_HS256') == 'true'
+    USERS_PER_PAGE = 100
+    USERS_MAX_PER_PAGE = 1000
+    USERS_STREAM_BATCH_SIZE = 1000
+    # as many rows as the bulk pool hashes in half the gunicorn timeout
+    USERS_BULK_MAX_ROWS = int(os.getenv('USERS_BULK_MAX_ROWS', min(10000, max(
+        1, int(BCRYPT_BULK_POOL_SIZE * GUNICORN_TIMEOUT / 2 / BCRYPT_HASH_SECONDS)))))
+    USERS_BULK_BATCH_SIZE = 1000
+    USERS_LOOKUP_MAX_KEYS = 500
+    TOKEN_CACHE_SIZE = 10000
+    TOKEN_CACHE_TTL = 30
+    # a redis:// URL shares the listing cache between workers; needs the redis package
+    USERS_CACHE_URL = os.getenv('USERS_CACHE_URL')
+    USERS_CACHE_SIZE = 1000
+    USERS_CACHE_TTL = 30
+    AVAILABILITY_SYNC_INTERVAL = 5
+    AVAILABILITY_ERROR_RATE = 0.01
+    AVAILABILITY_MIN_CAPACITY = 100000
+    AVAILABILITY_SYNC_OVERLAP = 1000
+    AVAILABILITY_REBUILD_INTERVAL = 3600
+    SQLALCHEMY_BINDS = replica_binds(os.getenv('DATABASE_REPLICA_URLS', ''))
+    SQLALCHEMY_REPLICAS = sorted(SQLALCHEMY_BINDS)
+    REPLICA_HEALTH_INTERVAL = 10
+    REPLICA_STICKY_SECONDS = 5
+    REPLICA_STICKY_SIZE = 10000
+    GUNICORN_WORKERS = GUNICORN_WORKERS
+    GUNICORN_WORKER_CLASS = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+    GUNICORN_THREADS = GUNICORN_THREADS
+    GUNICORN_TIMEOUT = GUNICORN_TIMEOUT
 
 
 class DevelopmentConfig(BaseConfig):
     '''Development Configuration'''
     DEBUG = True
+    JSONIFY_PRETTYPRINT_REGULAR = True
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 2,
+        'max_overflow': 3,
+        'pool_timeout': 5,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True
+    }
     BCRYPT_LOG_ROUNDS = 4
+    BCRYPT_POOL_SIZE = 0
+    USERS_BULK_MAX_ROWS = 10000
 
 
 class TestingConfig(BaseConfig):
@@ -23,12 +119,26 @@ class TestingConfig(BaseConfig):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_TEST_URL')
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_timeout': 5,
+        'pool_pre_ping': False
+    }
     BCRYPT_LOG_ROUNDS = 4
+    BCRYPT_POOL_SIZE = 0
+    BCRYPT_BULK_POOL_SIZE = 0
+    USERS_BULK_MAX_ROWS = 10000
     TOKEN_EXPIRATION_DAYS = 0
     TOKEN_EXPIRATION_SECONDS = 1
+    SQLALCHEMY_BINDS = {}
+    SQLALCHEMY_REPLICAS = []
 
 
 class ProductionConfig(BaseConfig):
     '''Production Configuration'''
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
+    # cached tokens are only invalidated in the worker that changed the
+    # user, so the others may act on stale active/admin flags this long
+    TOKEN_CACHE_TTL = 5
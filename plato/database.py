@@ -0,0 +1,226 @@
+import itertools
+import threading
+import time
+
+from flask import g, has_app_context, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, exc, orm
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+
+from plato.cache import TTLCache
+
+
+# engine options that only apply to a pool which keeps connections open
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle', 'pool_pre_ping')
+
+
+class TimedQueuePool(QueuePool):
+    '''A QueuePool that records how long checkouts take and how often they time out
+
+    The wait includes opening a new connection when the pool grows into
+    its overflow.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.wait_max_seconds = 0.0
+        self.timeouts = 0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started_at
+            with self._stats_lock:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.wait_max_seconds = max(self.wait_max_seconds, waited)
+
+
+def pool_stats(engine):
+    '''Describe an engine's connection pool as a dict'''
+    pool = engine.pool
+    stats = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow
+        })
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            stats.update({
+                'waits': pool.waits,
+                'wait_seconds': pool.wait_seconds,
+                'wait_max_seconds': pool.wait_max_seconds,
+                'timeouts': pool.timeouts
+            })
+    return stats
+
+
+class RoutingSession(SignallingSession):
+    '''Sends reads to the replica chosen for the request, everything else to the primary
+
+    A request only gets a replica when its view is wrapped in
+    `replica_reads`. Once the request writes anything it stays on the
+    primary, so it always reads its own writes.
+    '''
+
+    def get_bind(self, mapper=None, clause=None):
+        if not has_app_context():
+            return SignallingSession.get_bind(self, mapper, clause)
+        if isinstance(clause, UpdateBase) or self._flushing:
+            g.primary_only = True
+        replica = g.get('replica')
+        if replica is None or g.get('primary_only'):
+            return SignallingSession.get_bind(self, mapper, clause)
+        return get_state(self.app).db.get_engine(self.app, bind=replica)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        '''Apply SQLALCHEMY_ENGINE_OPTIONS on top of Flask-SQLAlchemy's defaults
+
+        Server databases get a TimedQueuePool. SQLite keeps the NullPool or
+        StaticPool picked above, and with DATABASE_PGBOUNCER set connections
+        are not pooled here at all, because PgBouncer in transaction mode
+        hands out server connections per transaction itself. Neither takes
+        the pool options.
+        '''
+        super().apply_driver_hacks(app, info, options)
+        engine_options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        if info.drivername.startswith('sqlite') or app.config.get('DATABASE_PGBOUNCER'):
+            for key in POOL_OPTIONS:
+                engine_options.pop(key, None)
+            if not info.drivername.startswith('sqlite'):
+                options['poolclass'] = NullPool
+        else:
+            options.setdefault('poolclass', TimedQueuePool)
+        options.update(engine_options)
+
+
+class ReplicaRouter:
+    '''Round-robin over the healthy read replicas in SQLALCHEMY_REPLICAS
+
+    Each replica is a key of SQLALCHEMY_BINDS. Replicas are probed every
+    REPLICA_HEALTH_INTERVAL seconds and one that drops a connection is
+    skipped until it answers again. For REPLICA_STICKY_SECONDS after a
+    write, reads stay on the primary, which covers replication lag right
+    after registering or changing a user. Gunicorn spreads a client's
+    requests over its workers, so besides pinning the user in this
+    process, a response that wrote sets a cookie for that long, and a
+    token issued that recently counts as a fresh write.
+    '''
+
+    STICKY_COOKIE = 'plato_primary'
+
+    def __init__(self, app=None):
+        self.replicas = []
+        self.health_interval = 10
+        self.sticky_seconds = 5
+        self.healthy = set()
+        self.recent_writes = TTLCache(maxsize=10000, ttl=5)
+        self._cycle = itertools.cycle([])
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.replicas = list(app.config.get('SQLALCHEMY_REPLICAS', []))
+        self.health_interval = app.config.get('REPLICA_HEALTH_INTERVAL', 10)
+        self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 5)
+        self.recent_writes = TTLCache(
+            maxsize=app.config.get('REPLICA_STICKY_SIZE', 10000),
+            ttl=self.sticky_seconds)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        self.reset()
+
+    def choose(self):
+        '''Return the bind key of the next healthy replica, or None for the primary'''
+        if not self.replicas:
+            return None
+        if has_request_context() and request.cookies.get(self.STICKY_COOKIE):
+            return None
+        if time.time() - self._checked_at >= self.health_interval:
+            self.check_health()
+        with self._lock:
+            for _ in self.replicas:
+                replica = next(self._cycle)
+                if replica in self.healthy:
+                    return replica
+        return None
+
+    def check_health(self):
+        from plato import db
+        for replica in self.replicas:
+            engine = db.get_engine(bind=replica)
+            if not event.contains(engine, 'handle_error', self._on_error):
+                event.listen(engine, 'handle_error', self._on_error)
+            try:
+                with engine.connect() as connection:
+                    connection.execute('SELECT 1')
+            except Exception:
+                self.healthy.discard(replica)
+            else:
+                self.healthy.add(replica)
+        self._checked_at = time.time()
+
+    def pin(self, user_id):
+        '''Keep reads about user_id on the primary for a while after a write'''
+        if self.replicas and user_id is not None:
+            self.recent_writes.set(user_id, True)
+
+    def is_pinned(self, user_id):
+        return self.recent_writes.get(user_id) is not None
+
+    def prefer_primary_for(self, user_id, issued_at=None):
+        '''Move the rest of the request to the primary if user_id was just written
+
+        issued_at, the POSIX time a token for user_id was issued, counts as
+        a write then: logging in or registering may have been handled by
+        another worker.
+        '''
+        if issued_at is not None and time.time() - issued_at < self.sticky_seconds:
+            self.pin(user_id)
+        if 'replica' in g and self.is_pinned(user_id):
+            g.pop('replica')
+
+    def reset(self):
+        with self._lock:
+            self.healthy = set()
+            self._cycle = itertools.cycle(self.replicas)
+            self._checked_at = 0
+        self.recent_writes.clear()
+
+    def _start(self):
+        g.pop('replica', None)
+        g.pop('primary_only', None)
+
+    def _finish(self, response):
+        if self.replicas and g.get('primary_only'):
+            response.set_cookie(self.STICKY_COOKIE, '1', max_age=self.sticky_seconds,
+                                httponly=True)
+        return response
+
+    def _on_error(self, context):
+        if context.is_disconnect:
+            from plato import db
+            for replica in self.replicas:
+                if db.get_engine(bind=replica) is context.engine:
+                    self.healthy.discard(replica)
@@ -0,0 +1,268 @@
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import contextmanager
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+from plato.instrumentation import timed
+
+
+class HasherBusy(Exception):
+    '''Raised when every hashing slot is taken'''
+
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+# the host-wide bcrypt slots; every process forked after share_host_slots,
+# the gunicorn workers and their pools when the app is preloaded, shares them
+_host_slots = None
+
+
+def share_host_slots(size):
+    '''Let at most size hashes run at once in this process and its future children'''
+    global _host_slots
+    _host_slots = multiprocessing.BoundedSemaphore(size) if size else None
+
+
+@contextmanager
+def _host_slot(timeout):
+    '''Hold a host-wide slot, waiting up to timeout seconds (None: for ever)'''
+    if _host_slots is None:
+        yield
+        return
+    if not _host_slots.acquire(timeout=timeout):
+        raise HasherBusy()
+    try:
+        yield
+    finally:
+        _host_slots.release()
+
+
+def _hash_password(password, rounds, timeout, submitted_at):
+    with _host_slot(timeout):
+        started_at = time.time()
+        pw_hash = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+    return pw_hash, started_at - submitted_at, time.time() - started_at
+
+
+def _check_password(pw_hash, password, timeout, submitted_at):
+    with _host_slot(timeout):
+        started_at = time.time()
+        try:
+            matches = bcrypt.checkpw(password, pw_hash)
+        except ValueError:
+            matches = False
+    return matches, started_at - submitted_at, time.time() - started_at
+
+
+def hash_cost(pw_hash):
+    '''Return the bcrypt cost factor encoded in pw_hash'''
+    return int(_to_bytes(pw_hash).split(b'$')[2])
+
+
+def calibrate(target_seconds, min_rounds=4, max_rounds=16, samples=3):
+    '''Time bcrypt on this host and pick the highest cost within target_seconds
+
+    Returns the recommended cost and the median hash time of every cost
+    that was tried. Each extra round doubles the work, so timing stops at
+    the first cost that goes over the target.
+    '''
+    timings = {}
+    recommended = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        durations = []
+        for _ in range(samples):
+            started_at = time.perf_counter()
+            bcrypt.hashpw(b'calibrate', bcrypt.gensalt(rounds))
+            durations.append(time.perf_counter() - started_at)
+        timings[rounds] = sorted(durations)[len(durations) // 2]
+        if timings[rounds] > target_seconds:
+            break
+        recommended = rounds
+    return recommended, timings
+
+
+class PasswordHasher:
+    '''Runs bcrypt in a bounded process pool instead of on the request thread
+
+    BCRYPT_POOL_SIZE worker processes hash at once and up to
+    BCRYPT_QUEUE_DEPTH more calls may wait for them. Calls beyond that
+    raise HasherBusy straight away so the view can answer 503. A pool
+    size of 0 hashes inline on the calling thread. A pool left broken by
+    a crashed worker process is replaced on the next call. Bulk hashing
+    runs in BCRYPT_BULK_POOL_SIZE processes of its own instead.
+
+    Every hash, in any gunicorn worker, also holds one of
+    BCRYPT_HOST_CONCURRENCY slots shared across the host, so bcrypt never
+    runs on more cores than there are. A login that waits longer than
+    BCRYPT_QUEUE_TIMEOUT seconds for one gets HasherBusy; bulk work waits.
+    '''
+
+    def __init__(self, app=None):
+        self.log_rounds = 12
+        self.pool_size = 0
+        self.queue_depth = 0
+        self.bulk_pool_size = 0
+        self.queue_timeout = None
+        self._executor = None
+        self._executor_pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'rejected': 0,
+            'queue_wait_seconds': 0.0,
+            'queue_wait_max_seconds': 0.0,
+            'hash_seconds': 0.0,
+            'hash_max_seconds': 0.0
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.log_rounds = app.config.get('BCRYPT_LOG_ROUNDS', 12)
+        self.pool_size = app.config.get('BCRYPT_POOL_SIZE', 0)
+        self.queue_depth = app.config.get('BCRYPT_QUEUE_DEPTH', 0)
+        self.bulk_pool_size = app.config.get('BCRYPT_BULK_POOL_SIZE', 0)
+        self.queue_timeout = app.config.get('BCRYPT_QUEUE_TIMEOUT')
+        # with preload_app this runs in the gunicorn master, before the fork
+        share_host_slots(app.config.get('BCRYPT_HOST_CONCURRENCY', 0))
+        self.shutdown()
+
+    def generate_password_hash(self, password, rounds=None):
+        if not password:
+            raise ValueError('Password must be non-empty.')
+        if rounds is None:
+            rounds = self.log_rounds
+        return self._run(_hash_password, _to_bytes(password), rounds, self.queue_timeout)
+
+    def check_password_hash(self, pw_hash, password):
+        if not pw_hash or not password:
+            return False
+        return self._run(_check_password, _to_bytes(pw_hash), _to_bytes(password),
+                         self.queue_timeout)
+
+    def generate_password_hashes(self, passwords, rounds=None):
+        '''Hash many passwords in parallel for bulk work
+
+        The per-worker pool is sized for logins, often a single process, so
+        bulk work gets BCRYPT_BULK_POOL_SIZE processes started for the call
+        and stopped after it. Interactive requests keep their own slots.
+        With a bulk pool size of 0 the passwords go through the regular pool.
+        '''
+        if rounds is None:
+            rounds = self.log_rounds
+        if not self.bulk_pool_size:
+            return [self.generate_password_hash(password, rounds) for password in passwords]
+        with timed('bcrypt'):
+            return self._run_many(passwords, rounds)
+
+    def warm(self):
+        '''Start the pool's processes before the first request needs them'''
+        if not self.pool_size:
+            self._run_one(_hash_password, b'warm-up', 4, None)
+            return
+        executor = self._get_executor()
+        futures = [executor.submit(_hash_password, b'warm-up', 4, None, time.time())
+                   for _ in range(self.pool_size)]
+        for future in futures:
+            _, queue_wait, hash_time = future.result()
+            self._record(queue_wait, hash_time)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self._executor_pid = None
+            self._slots = threading.BoundedSemaphore(self.pool_size + self.queue_depth) \
+                if self.pool_size else None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _get_executor(self):
+        # executors do not survive a fork, so each process builds its own
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.pool_size)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _discard_executor(self, executor):
+        '''Drop a broken executor so the next call builds a fresh one'''
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _run_many(self, passwords, rounds):
+        passwords = [_to_bytes(password) for password in passwords]
+        if not all(passwords):
+            raise ValueError('Password must be non-empty.')
+        # a few chunks per process keeps them all busy with little IPC
+        chunksize = max(1, len(passwords) // (self.bulk_pool_size * 4))
+        pw_hashes = []
+        with ProcessPoolExecutor(max_workers=self.bulk_pool_size) as executor:
+            results = executor.map(_hash_password, passwords, repeat(rounds), repeat(None),
+                                   repeat(time.time()), chunksize=chunksize)
+            for pw_hash, queue_wait, hash_time in results:
+                self._record(queue_wait, hash_time)
+                pw_hashes.append(pw_hash)
+        return pw_hashes
+
+    def _run(self, fn, *args):
+        with timed('bcrypt'):
+            return self._run_one(fn, *args)
+
+    def _run_one(self, fn, *args):
+        try:
+            if not self.pool_size:
+                result, queue_wait, hash_time = fn(*args, time.time())
+            else:
+                result, queue_wait, hash_time = self._run_pooled(fn, *args)
+        except HasherBusy:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise
+        self._record(queue_wait, hash_time)
+        return result
+
+    def _run_pooled(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            return self._submit(fn, *args)
+        finally:
+            self._slots.release()
+
+    def _submit(self, fn, *args):
+        # a worker process that died breaks the whole pool: rebuild it and retry once
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                return executor.submit(fn, *args, time.time()).result()
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+                if attempt:
+                    raise
+
+    def _record(self, queue_wait, hash_time):
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['queue_wait_seconds'] += queue_wait
+            self._stats['queue_wait_max_seconds'] = max(
+                self._stats['queue_wait_max_seconds'], queue_wait)
+            self._stats['hash_seconds'] += hash_time
+            self._stats['hash_max_seconds'] = max(self._stats['hash_max_seconds'], hash_time)
+
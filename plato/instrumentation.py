@@ -0,0 +1,145 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TIMED_KINDS = ('db', 'bcrypt', 'jwt', 'json')
+
+
+class Histogram:
+    '''A Prometheus-style histogram with one series per endpoint'''
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None:
+                series = self._series[endpoint] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram'
+        ]
+        with self._lock:
+            for endpoint, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f'{self.name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{endpoint="{endpoint}"}} {total}')
+                lines.append(f'{self.name}_count{{endpoint="{endpoint}"}} {count}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+@contextmanager
+def timed(kind):
+    '''Add the time spent in the block to the current request's `kind` total'''
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context() and 'timings' in g:
+            g.timings[kind] += time.perf_counter() - started_at
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_query(conn.info['query_started_at'].pop())
+
+
+def _handle_error(context):
+    # a failing statement never reaches after_cursor_execute
+    started_at = context.connection.info.get('query_started_at') if context.connection else None
+    if started_at:
+        _record_query(started_at.pop())
+
+
+def _record_query(started_at):
+    if has_request_context() and 'timings' in g:
+        g.timings['db'] += time.perf_counter() - started_at
+        g.statements += 1
+
+
+class Instrumentation:
+    '''Per-request SQL, bcrypt, JWT and serialization timings
+
+    Each response gets a Server-Timing header and every request is
+    recorded in histograms labelled by endpoint, which /metrics renders
+    in the Prometheus text format.
+    '''
+
+    def __init__(self, app=None):
+        self.request_duration = Histogram(
+            'plato_request_duration_seconds', 'Time spent handling the request.')
+        self.durations = {
+            kind: Histogram(f'plato_{kind}_duration_seconds', f'Time per request spent in {kind}.')
+            for kind in TIMED_KINDS
+        }
+        self.statements = Histogram(
+            'plato_db_statements', 'SQL statements executed per request.',
+            buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(Engine, 'handle_error', _handle_error)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def histograms(self):
+        return [self.request_duration, self.statements] + list(self.durations.values())
+
+    def clear(self):
+        for histogram in self.histograms():
+            histogram.clear()
+
+    def _start(self):
+        g.request_started_at = time.perf_counter()
+        g.timings = dict.fromkeys(TIMED_KINDS, 0.0)
+        g.statements = 0
+
+    def _finish(self, response):
+        if 'timings' not in g:
+            return response
+        total = time.perf_counter() - g.request_started_at
+        endpoint = request.endpoint or 'unmatched'
+        self.request_duration.observe(endpoint, total)
+        self.statements.observe(endpoint, g.statements)
+        metrics = []
+        for kind in TIMED_KINDS:
+            self.durations[kind].observe(endpoint, g.timings[kind])
+            metrics.append(f'{kind};dur={g.timings[kind] * 1000:.2f}')
+        metrics[0] += f';desc="{g.statements} queries"'
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        response.headers['Server-Timing'] = ', '.join(metrics)
+        return response
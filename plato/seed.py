@@ -0,0 +1,83 @@
+import csv
+import datetime
+import io
+import random
+import time
+
+from flask import current_app
+from sqlalchemy import func
+
+from plato import db, hasher, listing_cache
+from plato.api.models import User
+
+
+SEED_PASSWORD = 'test_pwd'
+SEED_EPOCH = datetime.datetime(2017, 6, 1)
+COLUMNS = ('username', 'email', 'password', 'active', 'admin', 'created_at')
+
+
+def generate_users(count, seed=0, offset=0, pw_hash='', days=730, until=SEED_EPOCH):
+    '''Yield count deterministic user rows as tuples in COLUMNS order
+
+    Sign-up dates fall within the `days` before `until`, denser towards
+    the end like a growing user base. About 5% of users are inactive and
+    1% are admins.
+    '''
+    rng = random.Random(seed)
+    for n in range(offset, offset + count):
+        age = rng.triangular(0, days, 0)
+        created_at = until - datetime.timedelta(days=age)
+        yield (
+            f'user{n}',
+            f'user{n}@example.com',
+            pw_hash,
+            rng.random() >= 0.05,
+            rng.random() < 0.01,
+            created_at
+        )
+
+
+def seed_users(count, seed=0, batch_size=10000, progress=None):
+    '''Bulk load count generated users, all with the password SEED_PASSWORD
+
+    The password is hashed once up front. Rows go in with COPY on Postgres
+    and with batched executemany inserts elsewhere.
+    '''
+    pw_hash = hasher.generate_password_hash(
+        SEED_PASSWORD, current_app.config.get('BCRYPT_LOG_ROUNDS')
+    ).decode()
+    offset = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+    db.session.commit()
+    rows = generate_users(count, seed, offset, pw_hash)
+    load = _copy_batch if db.engine.dialect.name == 'postgresql' else _insert_batch
+    started_at = time.time()
+    done = 0
+    while done < count:
+        batch = [row for _, row in zip(range(min(batch_size, count - done)), rows)]
+        load(batch)
+        done += len(batch)
+        if progress:
+            elapsed = time.time() - started_at
+            progress(f'{done}/{count} users ({done / max(elapsed, 1e-9):.0f} rows/s)')
+    listing_cache.clear()
+    return done
+
+
+def _insert_batch(batch):
+    with db.engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [dict(zip(COLUMNS, row)) for row in batch])
+
+
+def _copy_batch(batch):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.copy_expert(
+            f'COPY users ({", ".join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)', buffer
+        )
+        connection.commit()
+    finally:
+        connection.close()
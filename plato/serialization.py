@@ -0,0 +1,83 @@
+import datetime
+import json
+
+from flask import current_app
+from werkzeug.http import http_date
+
+from plato.instrumentation import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONProvider:
+    '''Serializes API responses straight to bytes, with orjson when it is installed
+
+    JSON_BACKEND picks 'orjson' or 'stdlib'; orjson falls back to the
+    standard library when it is not installed. Dates are written as the
+    RFC 1123 dates Flask's own encoder produces unless JSON_DATETIME_FORMAT
+    is 'iso', for ISO 8601. Output is only indented when
+    JSONIFY_PRETTYPRINT_REGULAR is set.
+    '''
+
+    def __init__(self, app=None):
+        self.backend = 'stdlib'
+        self.datetime_format = 'http'
+        self.indent = False
+        self.sort_keys = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('JSON_BACKEND', 'orjson')
+        self.backend = 'orjson' if backend == 'orjson' and orjson is not None else 'stdlib'
+        self.datetime_format = app.config.get('JSON_DATETIME_FORMAT', 'http')
+        self.indent = app.config.get('JSONIFY_PRETTYPRINT_REGULAR', False)
+        self.sort_keys = app.config.get('JSON_SORT_KEYS', False)
+        app.extensions['json_provider'] = self
+
+    def dumps(self, obj, indent=None):
+        '''Serialize obj to UTF-8 encoded JSON bytes, indented as configured unless told'''
+        if indent is None:
+            indent = self.indent
+        with timed('json'):
+            if self.backend == 'orjson':
+                option = 0
+                if indent:
+                    option |= orjson.OPT_INDENT_2
+                if self.sort_keys:
+                    option |= orjson.OPT_SORT_KEYS
+                if self.datetime_format != 'iso':
+                    option |= orjson.OPT_PASSTHROUGH_DATETIME
+                return orjson.dumps(obj, default=self._default, option=option)
+            return json.dumps(
+                obj,
+                default=self._default,
+                indent=2 if indent else None,
+                separators=(', ', ': ') if indent else (',', ':'),
+                sort_keys=self.sort_keys,
+                ensure_ascii=False
+            ).encode('utf-8')
+
+    def _default(self, obj):
+        if isinstance(obj, datetime.date):
+            if self.datetime_format == 'iso':
+                return obj.isoformat()
+            if isinstance(obj, datetime.datetime):
+                return http_date(obj.utctimetuple())
+            return http_date(obj.timetuple())
+        raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+def dumps(obj, indent=None):
+    return current_app.extensions['json_provider'].dumps(obj, indent)
+
+
+def jsonify(*args, **kwargs):
+    '''Drop-in for flask.jsonify that serializes with the app's JSONProvider'''
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    data = args[0] if len(args) == 1 else (args or kwargs)
+    return current_app.response_class(dumps(data) + b'\n', mimetype='application/json')
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+import time
+
+
+# how much longer than a bare interpreter `import manage` may take, which
+# every CLI invocation pays; Flask and Flask-Script account for most of it
+STARTUP_BUDGET_SECONDS = float(os.getenv('STARTUP_BUDGET_SECONDS', 0.4))
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module='manage'):
+    '''Import module in a fresh interpreter under -X importtime
+
+    Returns the wall time of the whole run and (cumulative us, self us,
+    name) for every imported module, slowest first. Pythons before 3.7
+    ignore -X importtime, in which case only the wall time is known.
+    '''
+    started_at = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    )
+    elapsed = time.perf_counter() - started_at
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr}')
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), int(own), name.strip()))
+    times.sort(reverse=True)
+    return elapsed, times
+
+
+def interpreter_time(runs=3):
+    '''The fastest of runs starts of a bare interpreter, the floor under import_times'''
+    best = float('inf')
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        subprocess.run([sys.executable, '-X', 'importtime', '-c', 'pass'],
+                       cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+def imported_modules(module='manage'):
+    '''Return the names of every module loaded by importing module'''
+    return {name for _, _, name in import_times(module)[1]}
@@ -1,6 +1,7 @@
 from flask_testing import TestCase
 
-from plato import create_app, db
+from plato import create_app, db, token_cache, listing_cache, availability, revocations, \
+    denylist
 
 
 app = create_app()
@@ -20,3 +21,8 @@ class BaseTestCase(TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        token_cache.clear()
+        listing_cache.clear()
+        availability.reset()
+        revocations.clear()
+        denylist.clear()
@@ -1,10 +1,15 @@
 import time
 import json
+import datetime
+from unittest import mock
 
-from plato.test.utils import add_user
+from flask import current_app
+
+from plato.test.utils import add_user, count_queries
+from plato.hashing import hash_cost
 from plato.test.base import BaseTestCase
-from plato.api.models import User
-from plato import db
+from plato.api.models import User, RefreshToken
+from plato import db, hasher, token_cache, revocations
 
 
 class TestAuthService(BaseTestCase):
@@ -24,6 +29,7 @@ class TestAuthService(BaseTestCase):
             self.assertTrue(data['status'] == 'success')
             self.assertTrue(data['message'] == 'Successfully registered')
             self.assertTrue(data['auth_token'] is not None)
+            self.assertTrue(data['refresh_token'] is not None)
             self.assertTrue(response.content_type == 'application/json')
             self.assertEqual(response.status_code, 201)
 
@@ -133,6 +139,7 @@ class TestAuthService(BaseTestCase):
             self.assertEqual(data['status'], 'success')
             self.assertEqual(data['message'], 'Successfully logged in')
             self.assertTrue(data['auth_token'] is not None)
+            self.assertTrue(data['refresh_token'] is not None)
             self.assertTrue(response.content_type == 'application/json')
             self.assertEqual(response.status_code, 200)
 
@@ -175,6 +182,33 @@ class TestAuthService(BaseTestCase):
             self.assertTrue(data['status'] == 'success')
             self.assertTrue(data['message'] == 'Successfully logged out')
 
+    def test_logout_revokes_token(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        # long enough that the token cannot expire before the check below
+        current_app.config['TOKEN_EXPIRATION_SECONDS'] = 60
+        try:
+            with self.client:
+                resp_login = self.client.post(
+                    '/auth/login',
+                    data=json.dumps(dict(
+                        email='foo@bar.com',
+                        password='test_pwd'
+                    )),
+                    content_type='application/json'
+                )
+                headers = dict(
+                    Authorization='Bearer ' + json.loads(resp_login.data.decode())['auth_token']
+                )
+                response = self.client.get('/auth/logout', headers=headers)
+                self.assertEqual(response.status_code, 200)
+                response = self.client.get('/auth/status', headers=headers)
+                data = json.loads(response.data.decode())
+                self.assertTrue(data['status'] == 'error')
+                self.assertTrue(data['message'] == 'Token revoked. Please log in again.')
+                self.assertEqual(response.status_code, 401)
+        finally:
+            current_app.config['TOKEN_EXPIRATION_SECONDS'] = 1
+
     def test_invalid_logout_expired_token(self):
         add_user('foo', 'foo@bar.com', 'test_pwd')
         with self.client:
@@ -330,3 +364,417 @@ class TestAuthService(BaseTestCase):
             self.assertTrue(
                 data['message'] == 'Something went wrong. Please contact us.')
             self.assertEqual(response.status_code, 401)
+
+    def test_auth_token_is_cached(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='foo@bar.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json'
+            )
+            headers = dict(
+                Authorization='Bearer ' + json.loads(resp_login.data.decode())['auth_token']
+            )
+            # the counters are totals that clearing the cache leaves alone
+            before = token_cache.stats()
+            self.client.get('/auth/status', headers=headers)
+            self.client.get('/auth/status', headers=headers)
+            stats = token_cache.stats()
+            self.assertEqual(stats['size'], 1)
+            self.assertEqual(stats['misses'] - before['misses'], 1)
+            self.assertEqual(stats['hits'] - before['hits'], 1)
+
+    def test_cached_auth_token_inactive(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='foo@bar.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json'
+            )
+            headers = dict(
+                Authorization='Bearer ' + json.loads(resp_login.data.decode())['auth_token']
+            )
+            response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            user = User.query.filter_by(email='foo@bar.com').first()
+            user.active = False
+            db.session.commit()
+            response = self.client.get('/auth/status', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'error')
+            self.assertTrue(
+                data['message'] == 'Something went wrong. Please contact us.')
+            self.assertEqual(response.status_code, 401)
+
+    def test_auth_status_query_count(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='foo@bar.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json'
+            )
+            headers = dict(
+                Authorization='Bearer ' + json.loads(resp_login.data.decode())['auth_token']
+            )
+            # token not cached yet: the user loaded by authenticate is reused
+            with count_queries() as statements:
+                response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(statements), 1)
+            # token cached: only the view loads the user
+            with count_queries() as statements:
+                response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(statements), 1)
+
+    def test_logout_query_count(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='foo@bar.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json'
+            )
+            headers = dict(
+                Authorization='Bearer ' + json.loads(resp_login.data.decode())['auth_token']
+            )
+            with count_queries() as statements:
+                response = self.client.get('/auth/logout', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            # just the user: without a refresh token no session is ended
+            self.assertEqual(len(statements), 1)
+            # logged out: refused by the denylist, still without a query
+            with count_queries() as statements:
+                response = self.client.get('/auth/logout', headers=headers)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(len(statements), 0)
+
+    def test_user_login_hasher_busy(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        pool_size, queue_depth = hasher.pool_size, hasher.queue_depth
+        hasher.pool_size, hasher.queue_depth = 1, 0
+        hasher.shutdown()
+        hasher._slots.acquire()
+        try:
+            with self.client:
+                response = self.client.post(
+                    '/auth/login',
+                    data=json.dumps(dict(
+                        email='foo@bar.com',
+                        password='test_pwd'
+                    )),
+                    content_type='application/json'
+                )
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(data['status'], 'error')
+                self.assertIn('Server is busy', data['message'])
+        finally:
+            hasher.pool_size, hasher.queue_depth = pool_size, queue_depth
+            hasher.shutdown()
+
+    def test_user_login_rehashes_password(self):
+        user = add_user('foo', 'foo@bar.com', 'test_pwd')
+        self.assertEqual(hash_cost(user.password), 4)
+        current_app.config['BCRYPT_LOG_ROUNDS'] = 5
+        try:
+            with self.client:
+                response = self.client.post(
+                    '/auth/login',
+                    data=json.dumps(dict(
+                        email='foo@bar.com',
+                        password='test_pwd'
+                    )),
+                    content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 200)
+        finally:
+            current_app.config['BCRYPT_LOG_ROUNDS'] = 4
+        user = User.query.filter_by(email='foo@bar.com').first()
+        self.assertEqual(hash_cost(user.password), 5)
+        self.assertTrue(hasher.check_password_hash(user.password, 'test_pwd'))
+
+    def test_user_login_concurrent_rehash(self):
+        user = add_user('foo', 'foo@bar.com', 'test_pwd')
+        hash_password = User.hash_password
+
+        def rehash_elsewhere(password):
+            # another login re-hashes and commits while this one is hashing
+            with db.engine.begin() as connection:
+                connection.execute(
+                    User.__table__.update().values(
+                        password=hash_password(password), version=User.version + 1))
+            return hash_password(password)
+
+        current_app.config['BCRYPT_LOG_ROUNDS'] = 5
+        try:
+            with mock.patch.object(User, 'hash_password', side_effect=rehash_elsewhere):
+                with self.client:
+                    response = self.client.post(
+                        '/auth/login',
+                        data=json.dumps(dict(
+                            email='foo@bar.com',
+                            password='test_pwd'
+                        )),
+                        content_type='application/json'
+                    )
+                    data = json.loads(response.data.decode())
+                    self.assertEqual(response.status_code, 200)
+                    self.assertTrue(data['auth_token'])
+        finally:
+            current_app.config['BCRYPT_LOG_ROUNDS'] = 4
+        user = User.query.filter_by(email='foo@bar.com').first()
+        self.assertEqual(user.version, 2)
+        self.assertEqual(hash_cost(user.password), 5)
+
+    def login_for_tokens(self):
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(
+                email='foo@bar.com',
+                password='test_pwd'
+            )),
+            content_type='application/json'
+        )
+        data = json.loads(resp_login.data.decode())
+        return data['auth_token'], data['refresh_token']
+
+    def login_for_refresh_token(self):
+        return self.login_for_tokens()[1]
+
+    def refresh(self, refresh_token):
+        return self.client.post(
+            '/auth/refresh',
+            data=json.dumps(dict(refresh_token=refresh_token)),
+            content_type='application/json'
+        )
+
+    def test_refresh(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            refresh_token = self.login_for_refresh_token()
+            hashes = hasher.stats()['calls']
+            response = self.refresh(refresh_token)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['status'] == 'success')
+            self.assertTrue(data['message'] == 'Successfully refreshed')
+            self.assertNotEqual(data['refresh_token'], refresh_token)
+            self.assertEqual(hasher.stats()['calls'], hashes)
+            response = self.client.get(
+                '/auth/status',
+                headers=dict(Authorization='Bearer ' + data['auth_token'])
+            )
+            self.assertEqual(response.status_code, 200)
+            # rotated: the successor works once, too
+            response = self.refresh(data['refresh_token'])
+            self.assertEqual(response.status_code, 200)
+
+    def test_refresh_token_is_stored_hashed(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            refresh_token = self.login_for_refresh_token()
+        self.assertIsNone(RefreshToken.query.filter_by(token_hash=refresh_token).first())
+        self.assertIsNotNone(RefreshToken.query.filter_by(
+            token_hash=RefreshToken.digest(refresh_token)).first())
+
+    def test_refresh_token_reuse_revokes_family(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            refresh_token = self.login_for_refresh_token()
+            response = self.refresh(refresh_token)
+            rotated = json.loads(response.data.decode())['refresh_token']
+            response = self.refresh(refresh_token)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(data['message'] == 'Invalid refresh token. Please log in again.')
+            response = self.refresh(rotated)
+            self.assertEqual(response.status_code, 401)
+        self.assertEqual(RefreshToken.query.count(), 0)
+
+    def test_refresh_inactive_or_expired(self):
+        user = add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            refresh_token = self.login_for_refresh_token()
+            user.active = False
+            db.session.commit()
+            response = self.refresh(refresh_token)
+            self.assertEqual(response.status_code, 401)
+            user.active = True
+            RefreshToken.query.update({'expires_at': datetime.datetime.utcnow()})
+            db.session.commit()
+            response = self.refresh(refresh_token)
+            self.assertEqual(response.status_code, 401)
+        self.assertEqual(RefreshToken.prune(), 1)
+
+    def test_refresh_fails_after_logout(self):
+        self.app.config['TOKEN_EXPIRATION_SECONDS'] = 60
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            auth_token, refresh_token = self.login_for_tokens()
+            _, other_session = self.login_for_tokens()
+            response = self.client.get(
+                '/auth/logout',
+                data=json.dumps(dict(refresh_token=refresh_token)),
+                content_type='application/json',
+                headers=dict(Authorization='Bearer ' + auth_token)
+            )
+            self.assertEqual(response.status_code, 200)
+            response = self.refresh(refresh_token)
+            self.assertEqual(response.status_code, 401)
+            # the other session is left alone
+            response = self.refresh(other_session)
+            self.assertEqual(response.status_code, 200)
+
+    def test_refresh_fails_after_logout_with_header(self):
+        self.app.config['TOKEN_EXPIRATION_SECONDS'] = 60
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            auth_token, refresh_token = self.login_for_tokens()
+            response = self.client.get('/auth/logout', headers={
+                'Authorization': 'Bearer ' + auth_token,
+                'X-Refresh-Token': refresh_token
+            })
+            self.assertEqual(response.status_code, 200)
+            response = self.refresh(refresh_token)
+            self.assertEqual(response.status_code, 401)
+
+    def test_logout_without_refresh_token_keeps_other_sessions(self):
+        self.app.config['TOKEN_EXPIRATION_SECONDS'] = 60
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            auth_token, _ = self.login_for_tokens()
+            _, other_session = self.login_for_tokens()
+            response = self.client.get(
+                '/auth/logout',
+                headers=dict(Authorization='Bearer ' + auth_token)
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.refresh(other_session).status_code, 200)
+
+    def test_logout_everywhere_ends_every_session(self):
+        self.app.config['TOKEN_EXPIRATION_SECONDS'] = 60
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        add_user('bar', 'bar@foo.com', 'test_pwd')
+        RefreshToken.issue(2)
+        db.session.commit()
+        with self.client:
+            auth_token, refresh_token = self.login_for_tokens()
+            _, other_session = self.login_for_tokens()
+            response = self.client.get(
+                '/auth/logout',
+                data=json.dumps(dict(everywhere=True)),
+                content_type='application/json',
+                headers=dict(Authorization='Bearer ' + auth_token)
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.refresh(refresh_token).status_code, 401)
+            self.assertEqual(self.refresh(other_session).status_code, 401)
+        # another user's sessions are not touched
+        self.assertEqual(RefreshToken.query.filter_by(user_id=2).count(), 1)
+
+    def test_refresh_invalid(self):
+        with self.client:
+            response = self.refresh('invalid')
+            self.assertEqual(response.status_code, 401)
+            response = self.client.post(
+                '/auth/refresh',
+                data=json.dumps(dict()),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertTrue(data['message'] == 'Invalid payload')
+
+
+class TestTokenClaims(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['TOKEN_CLAIMS'] = True
+        self.app.config['TOKEN_EXPIRATION_SECONDS'] = 60
+
+    def tearDown(self):
+        self.app.config['TOKEN_CLAIMS'] = False
+        self.app.config['TOKEN_EXPIRATION_SECONDS'] = 1
+        super().tearDown()
+
+    def login(self):
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(
+                email='foo@bar.com',
+                password='test_pwd'
+            )),
+            content_type='application/json'
+        )
+        return json.loads(resp_login.data.decode())['auth_token']
+
+    def test_token_carries_claims(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        self.app.config['TOKEN_CLAIMS_MAX_AGE'] = 30
+        try:
+            with self.client:
+                payload = User.decode_auth_payload(self.login())
+        finally:
+            self.app.config['TOKEN_CLAIMS_MAX_AGE'] = 300
+        self.assertTrue(payload['active'])
+        self.assertFalse(payload['admin'])
+        self.assertLessEqual(payload['exp'] - payload['iat'], 30)
+
+    def test_authenticate_skips_the_database(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            headers = dict(Authorization='Bearer ' + self.login())
+            with count_queries() as statements:
+                response = self.client.get('/auth/logout', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            # the user is never loaded, and there is no session to end
+            self.assertEqual(len(statements), 0)
+            headers = dict(Authorization='Bearer ' + self.login())
+            with count_queries() as statements:
+                response = self.client.get('/auth/logout?everywhere=true', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            # only logout's own write
+            self.assertEqual(len(statements), 1)
+            self.assertTrue(statements[0].startswith('DELETE FROM refresh_tokens'))
+
+    def test_deactivation_revokes_tokens(self):
+        user = add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            headers = dict(Authorization='Bearer ' + self.login())
+            response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            user.active = False
+            db.session.commit()
+            response = self.client.get('/auth/status', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(
+                data['message'] == 'Something went wrong. Please contact us.')
+
+    def test_tokens_issued_after_revocation_are_accepted(self):
+        user = add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            old_headers = dict(Authorization='Bearer ' + self.login())
+            revocations.revoke(user.id)
+            new_headers = dict(Authorization='Bearer ' + self.login())
+            response = self.client.get('/auth/logout', headers=old_headers)
+            self.assertEqual(response.status_code, 401)
+            response = self.client.get('/auth/logout', headers=new_headers)
+            self.assertEqual(response.status_code, 200)
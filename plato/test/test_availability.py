@@ -0,0 +1,166 @@
+import datetime
+import json
+import threading
+import time
+import unittest
+
+from plato import db, availability
+from plato.api.models import User
+from plato.availability import BloomFilter
+from plato.test.base import BaseTestCase
+from plato.test.utils import add_user, count_queries
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for n in range(1000):
+            bloom.add(f'user{n}')
+        self.assertTrue(all(f'user{n}' in bloom for n in range(1000)))
+        self.assertEqual(bloom.count, 1000)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for n in range(1000):
+            bloom.add(f'user{n}')
+        false_positives = sum(f'other{n}' in bloom for n in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TestAvailability(BaseTestCase):
+
+    def test_available(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            response = self.client.get('/auth/available?username=bar&email=bar@foo.com')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['status'] == 'success')
+            self.assertEqual(data['data']['available'], {'username': True, 'email': True})
+
+    def test_taken(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            response = self.client.get('/auth/available?username=foo&email=foo@bar.com')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['available'], {'username': False, 'email': False})
+
+    def test_taken_right_after_registration(self):
+        with self.client:
+            response = self.client.get('/auth/available?username=foo')
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['data']['available']['username'])
+            self.client.post(
+                '/auth/register',
+                data=json.dumps(dict(
+                    username='foo',
+                    email='foo@bar.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json'
+            )
+            response = self.client.get('/auth/available?username=foo&email=foo@bar.com')
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['data']['available'], {'username': False, 'email': False})
+
+    def test_unknown_name_skips_the_database(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        availability.sync()
+        with self.client:
+            with count_queries() as statements:
+                response = self.client.get('/auth/available?username=bar')
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['data']['available']['username'])
+            self.assertEqual(statements, [])
+
+    def test_picks_up_rows_inserted_elsewhere(self):
+        availability.sync()
+        # a Core insert bypasses the ORM hooks, as another process would
+        with db.engine.begin() as connection:
+            connection.execute(User.__table__.insert(), dict(
+                username='foo', email='foo@bar.com', password='',
+                active=True, admin=False, created_at=datetime.datetime.now()))
+        availability._synced_at = 0
+        self.assertTrue(availability.might_exist('username', 'foo'))
+
+    def test_picks_up_rows_committed_out_of_id_order(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with db.engine.begin() as connection:
+            connection.execute(User.__table__.insert(), dict(
+                id=10, username='bar', email='bar@bar.com', password='',
+                active=True, admin=False, created_at=datetime.datetime.now()))
+        availability.sync()
+        # id 5 was handed out before 10 but its transaction committed later
+        with db.engine.begin() as connection:
+            connection.execute(User.__table__.insert(), dict(
+                id=5, username='baz', email='baz@bar.com', password='',
+                active=True, admin=False, created_at=datetime.datetime.now()))
+        availability._synced_at = 0
+        self.assertTrue(availability.might_exist('username', 'baz'))
+        self.assertEqual(availability._filters['username'].count, 3)
+
+    def test_concurrent_first_use_builds_once(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        builds = []
+        build = availability._build
+
+        def counting_build():
+            builds.append(1)
+            time.sleep(0.05)
+            build()
+
+        availability._build = counting_build
+        try:
+            threads = [threading.Thread(target=self.might_exist_in_app) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            del availability._build
+        self.assertEqual(len(builds), 1)
+
+    def test_rebuild_keeps_serving_the_old_filters(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        availability.sync()
+        old_filters = availability._filters
+        loaded, finish = threading.Event(), threading.Event()
+        load = availability._load
+
+        def slow_load():
+            result = load()
+            loaded.set()
+            finish.wait(5)
+            return result
+
+        availability._load = slow_load
+        try:
+            availability._built_at = 0
+            availability._synced_at = 0
+            self.assertTrue(availability.might_exist('username', 'foo'))
+            self.assertTrue(loaded.wait(5))
+            # the lock is free and the old filters still answer
+            self.assertTrue(availability._lock.acquire(blocking=False))
+            availability._lock.release()
+            self.assertFalse(availability.might_exist('username', 'bar'))
+            self.assertIs(availability._filters, old_filters)
+            finish.set()
+            availability._rebuilder.join(5)
+        finally:
+            del availability._load
+        self.assertIsNot(availability._filters, old_filters)
+        self.assertTrue(availability.might_exist('username', 'foo'))
+
+    def might_exist_in_app(self):
+        with self.app.app_context():
+            availability.might_exist('username', 'foo')
+            db.session.remove()
+
+    def test_no_parameters(self):
+        with self.client:
+            response = self.client.get('/auth/available')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertTrue(data['status'] == 'error')
+            self.assertTrue(data['message'] == 'Provide a username or email')
@@ -0,0 +1,56 @@
+import os
+
+from plato.api.models import User
+from plato.bench import compare, parse_mix, percentile, run_benchmark, summarize, json_benchmark, \
+    bench_database
+from plato.test.base import BaseTestCase
+
+
+class TestBench(BaseTestCase):
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('login=1,user=20'), {'login': 1, 'user': 20})
+        self.assertRaises(ValueError, parse_mix, 'foo=1')
+        self.assertRaises(ValueError, parse_mix, 'login')
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 99), 0.0)
+
+    def test_compare(self):
+        baseline = {'endpoints': {'user': summarize([0.01] * 10, 0, 1.0)}}
+        results = {'endpoints': {'user': summarize([0.011] * 10, 0, 1.0)}}
+        self.assertEqual(compare(results, baseline, tolerance=0.2), [])
+        results = {'endpoints': {'user': summarize([0.02] * 5, 0, 1.0)}}
+        regressions = compare(results, baseline, tolerance=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('user: p95'))
+
+    def test_run_benchmark(self):
+        results = run_benchmark(self.app, requests=40, concurrency=2,
+                                mix='login=1,users=1,user=2', users=20)
+        self.assertEqual(results['total']['requests'], 40)
+        self.assertEqual(results['total']['errors'], 0)
+        self.assertEqual(set(results['endpoints']), {'login', 'users', 'user'})
+        self.assertTrue(results['endpoints']['user']['p99_ms'] > 0)
+
+    def test_bench_database_is_throwaway_by_default(self):
+        configured = self.app.config['SQLALCHEMY_DATABASE_URI']
+        with bench_database(self.app) as database_url:
+            self.assertNotEqual(database_url, configured)
+            path = database_url[len('sqlite:///'):]
+            results = run_benchmark(self.app, requests=4, concurrency=1, mix='user=1', users=5)
+            self.assertEqual(results['total']['errors'], 0)
+            self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.app.config['SQLALCHEMY_DATABASE_URI'], configured)
+        self.assertEqual(User.query.count(), 0)
+
+    def test_json_benchmark(self):
+        results = json_benchmark(users=100, repeat=1)
+        self.assertIn('flask', results)
+        self.assertIn('stdlib', results)
+        self.assertEqual(results['stdlib']['bytes'], results.get('orjson', results['stdlib'])['bytes'])
+        self.assertLess(results['stdlib']['bytes'], results['flask']['bytes'])
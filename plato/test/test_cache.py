@@ -0,0 +1,82 @@
+import datetime
+import time
+import unittest
+
+from plato.cache import TTLCache, ListingCache, listing_position
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        self.assertIsNone(cache.get('foo'))
+        cache.set('foo', 'bar')
+        self.assertEqual(cache.get('foo'), 'bar')
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_clear_keeps_the_counters(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set('foo', 'bar')
+        cache.get('foo')
+        cache.get('baz')
+        cache.clear()
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 0, 'maxsize': 10})
+
+    def test_entries_expire(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set('foo', 'bar', expires_at=time.time() + 0.05)
+        self.assertEqual(cache.get('foo'), 'bar')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('foo'))
+        self.assertEqual(len(cache), 0)
+
+    def test_already_expired_entries_are_not_stored(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set('foo', 'bar', expires_at=time.time() - 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_delete_where(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.delete_where(lambda value: value == 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_disabled_cache(self):
+        cache = TTLCache(maxsize=0, ttl=60)
+        cache.set('foo', 'bar')
+        self.assertIsNone(cache.get('foo'))
+
+
+class TestListingCache(unittest.TestCase):
+    def test_invalidate_drops_only_pages_covering_the_position(self):
+        cache = ListingCache()
+        cache.backend = TTLCache(maxsize=10, ttl=60)
+        day = datetime.datetime(2017, 6, 1)
+        cursor = listing_position(day, 10)
+        cache.set('first', {'low': cursor, 'high': None})
+        cache.set('second', {'low': listing_position(day, 5), 'high': cursor})
+        cache.set('last', {'low': None, 'high': listing_position(day, 5)})
+        cache.invalidate(day, 7)
+        self.assertIsNotNone(cache.get('first'))
+        self.assertIsNone(cache.get('second'))
+        self.assertIsNotNone(cache.get('last'))
+        cache.invalidate(day - datetime.timedelta(days=1), 1)
+        self.assertIsNone(cache.get('last'))
+        self.assertIsNotNone(cache.get('first'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,8 +21,12 @@ class TestDevelopmentConfig(TestCase):
         self.assertFalse(current_app is None)
         self.assertTrue(app.config['SQLALCHEMY_DATABASE_URI'] == os.environ.get('DATABASE_URL'))
         self.assertTrue(app.config['BCRYPT_LOG_ROUNDS'] == 4)
-        self.assertTrue(app.config['TOKEN_EXPIRATION_DAYS'] == 30)
-        self.assertTrue(app.config['TOKEN_EXPIRATION_SECONDS'] == 0)
+        self.assertTrue(app.config['BCRYPT_POOL_SIZE'] == 0)
+        self.assertTrue(app.config['TOKEN_EXPIRATION_DAYS'] == 0)
+        self.assertTrue(app.config['TOKEN_EXPIRATION_SECONDS'] == 900)
+        self.assertTrue(app.config['REFRESH_TOKEN_EXPIRATION_DAYS'] == 30)
+        self.assertFalse(app.config['TOKEN_CLAIMS'])
+        self.assertTrue(app.config['TOKEN_CLAIMS_MAX_AGE'] == 300)
 
 
 class TestTestingConfig(TestCase):
@@ -39,6 +43,7 @@ class TestTestingConfig(TestCase):
             app.config['SQLALCHEMY_DATABASE_URI'] == os.environ.get('DATABASE_TEST_URL')
         )
         self.assertTrue(app.config['BCRYPT_LOG_ROUNDS'] == 4)
+        self.assertTrue(app.config['BCRYPT_POOL_SIZE'] == 0)
         self.assertTrue(app.config['TOKEN_EXPIRATION_DAYS'] == 0)
         self.assertTrue(app.config['TOKEN_EXPIRATION_SECONDS'] == 1)
 
@@ -53,8 +58,24 @@ class TestProductionConfig(TestCase):
         self.assertFalse(app.config['DEBUG'])
         self.assertFalse(app.config['TESTING'])
         self.assertTrue(app.config['BCRYPT_LOG_ROUNDS'] == 13)
-        self.assertTrue(app.config['TOKEN_EXPIRATION_DAYS'] == 30)
-        self.assertTrue(app.config['TOKEN_EXPIRATION_SECONDS'] == 0)
+        self.assertTrue(app.config['BCRYPT_POOL_SIZE'] > 0)
+        # no more hashes run at once across the host than it has cores
+        self.assertTrue(app.config['BCRYPT_HOST_CONCURRENCY'] == os.cpu_count())
+        # and no worker turns a request away while it has threads to wait in
+        self.assertTrue(app.config['BCRYPT_POOL_SIZE'] + app.config['BCRYPT_QUEUE_DEPTH'] ==
+                        app.config['GUNICORN_THREADS'])
+        self.assertTrue(app.config['TOKEN_EXPIRATION_DAYS'] == 0)
+        self.assertTrue(app.config['TOKEN_EXPIRATION_SECONDS'] == 900)
+        self.assertTrue(app.config['REFRESH_TOKEN_EXPIRATION_DAYS'] == 30)
+        self.assertTrue(app.config['GUNICORN_WORKERS'] > 0)
+        self.assertTrue(app.config['GUNICORN_WORKER_CLASS'] == 'gthread')
+        self.assertTrue(app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'] ==
+                        app.config['GUNICORN_THREADS'])
+        # a full bulk import hashes well within the request timeout
+        self.assertTrue(app.config['BCRYPT_BULK_POOL_SIZE'] == os.cpu_count())
+        self.assertTrue(app.config['USERS_BULK_MAX_ROWS'] * app.config['BCRYPT_HASH_SECONDS'] /
+                        app.config['BCRYPT_BULK_POOL_SIZE'] <= app.config['GUNICORN_TIMEOUT'] / 2)
+        self.assertTrue(app.config['TOKEN_CACHE_TTL'] <= 5)
 
 
 if __name__ == '__main__':
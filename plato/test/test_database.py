@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
+
+from plato import db
+from plato.database import TimedQueuePool, pool_stats
+from plato.test.base import BaseTestCase
+
+
+class TestEngineOptions(BaseTestCase):
+    def test_server_database_gets_a_timed_pool(self):
+        options = {}
+        db.apply_driver_hacks(self.app, make_url('postgresql://plato@db/plato'), options)
+        self.assertIs(options['poolclass'], TimedQueuePool)
+        self.assertEqual(options['pool_size'], 5)
+        self.assertEqual(options['max_overflow'], 5)
+        self.assertFalse(options['pool_pre_ping'])
+
+    def test_pgbouncer_disables_pooling(self):
+        self.app.config['DATABASE_PGBOUNCER'] = True
+        try:
+            options = {}
+            db.apply_driver_hacks(self.app, make_url('postgresql://plato@db/plato'), options)
+        finally:
+            self.app.config['DATABASE_PGBOUNCER'] = False
+        self.assertIs(options['poolclass'], NullPool)
+        self.assertNotIn('pool_size', options)
+
+    def test_sqlite_ignores_pool_options(self):
+        options = {}
+        db.apply_driver_hacks(self.app, make_url('sqlite:////tmp/plato.db'), options)
+        self.assertIs(options['poolclass'], NullPool)
+        self.assertNotIn('pool_size', options)
+
+
+class TestTimedQueuePool(BaseTestCase):
+    def test_pool_stats(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            engine = create_engine(
+                'sqlite:///' + os.path.join(tmpdir, 'pool.db'),
+                poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.1
+            )
+            connection = engine.connect()
+            stats = pool_stats(engine)
+            self.assertEqual(stats['class'], 'TimedQueuePool')
+            self.assertEqual(stats['checked_out'], 1)
+            self.assertEqual(stats['overflow'], 0)
+            with self.assertRaises(exc.TimeoutError):
+                engine.connect()
+            connection.close()
+            stats = pool_stats(engine)
+            self.assertEqual(stats['checked_out'], 0)
+            self.assertEqual(stats['checked_in'], 1)
+            self.assertEqual(stats['waits'], 2)
+            self.assertEqual(stats['timeouts'], 1)
+            self.assertGreaterEqual(stats['wait_max_seconds'], 0.1)
+            engine.dispose()
+
+
+class TestHealth(BaseTestCase):
+    def test_ready(self):
+        with self.client:
+            response = self.client.get('/health/ready')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['status'] == 'success')
+            primary = data['data']['databases']['primary']
+            self.assertTrue(primary['healthy'])
+            self.assertIn('class', primary['pool'])
+
+    def test_not_ready_without_primary(self):
+        uri = self.app.config['SQLALCHEMY_DATABASE_URI']
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////nonexistent/plato.db'
+        try:
+            with self.client:
+                response = self.client.get('/health/ready')
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 503)
+                self.assertTrue(data['status'] == 'fail')
+                self.assertFalse(data['data']['databases']['primary']['healthy'])
+        finally:
+            self.app.config['SQLALCHEMY_DATABASE_URI'] = uri
@@ -0,0 +1,124 @@
+import threading
+import unittest
+
+from plato import hashing
+from plato.hashing import PasswordHasher, HasherBusy, calibrate, hash_cost, share_host_slots
+
+
+class TestPasswordHasher(unittest.TestCase):
+    def create_hasher(self, pool_size=0, queue_depth=0, bulk_pool_size=0):
+        hasher = PasswordHasher()
+        hasher.log_rounds = 4
+        hasher.pool_size = pool_size
+        hasher.queue_depth = queue_depth
+        hasher.bulk_pool_size = bulk_pool_size
+        hasher.shutdown()
+        self.addCleanup(hasher.shutdown)
+        return hasher
+
+    def test_inline_hash_and_check(self):
+        hasher = self.create_hasher()
+        pw_hash = hasher.generate_password_hash('test_pwd')
+        self.assertTrue(pw_hash.startswith(b'$2b$04$'))
+        self.assertTrue(hasher.check_password_hash(pw_hash, 'test_pwd'))
+        self.assertFalse(hasher.check_password_hash(pw_hash, 'wrong_pwd'))
+        self.assertEqual(hasher.stats()['calls'], 3)
+
+    def test_pooled_hash_and_check(self):
+        hasher = self.create_hasher(pool_size=1, queue_depth=1)
+        pw_hash = hasher.generate_password_hash('test_pwd')
+        self.assertTrue(hasher.check_password_hash(pw_hash.decode(), 'test_pwd'))
+        stats = hasher.stats()
+        self.assertEqual(stats['calls'], 2)
+        self.assertGreater(stats['hash_seconds'], 0)
+
+    def test_broken_pool_is_replaced(self):
+        hasher = self.create_hasher(pool_size=1, queue_depth=1)
+        pw_hash = hasher.generate_password_hash('test_pwd')
+        broken = hasher._executor
+        for process in list(broken._processes.values()):
+            process.kill()
+            process.join()
+        self.assertTrue(hasher.check_password_hash(pw_hash, 'test_pwd'))
+        self.assertIsNot(hasher._executor, broken)
+        self.assertEqual(len(hasher.generate_password_hashes(['a', 'b'])), 2)
+
+    def test_empty_password(self):
+        hasher = self.create_hasher()
+        self.assertRaises(ValueError, hasher.generate_password_hash, '')
+        self.assertRaises(ValueError, hasher.generate_password_hash, None)
+        self.assertFalse(hasher.check_password_hash('not a hash', None))
+
+    def test_invalid_hash(self):
+        hasher = self.create_hasher()
+        self.assertFalse(hasher.check_password_hash('not a hash', 'test_pwd'))
+
+    def test_saturated_pool_rejects(self):
+        hasher = self.create_hasher(pool_size=1, queue_depth=0)
+        hasher._slots.acquire()
+        self.assertRaises(HasherBusy, hasher.generate_password_hash, 'test_pwd')
+        self.assertEqual(hasher.stats()['rejected'], 1)
+        hasher._slots.release()
+
+
+    def test_host_slots_are_shared_by_every_pool(self):
+        host_slots = hashing._host_slots
+        self.addCleanup(setattr, hashing, '_host_slots', host_slots)
+        share_host_slots(1)
+        # created after the slots, like gunicorn workers forked from the master
+        first = self.create_hasher(pool_size=1, queue_depth=0)
+        second = self.create_hasher(pool_size=1, queue_depth=0)
+        first.queue_timeout = second.queue_timeout = 0.1
+        pw_hash = first.generate_password_hash('test_pwd')
+        hashing._host_slots.acquire()
+        self.assertRaises(HasherBusy, second.check_password_hash, pw_hash, 'test_pwd')
+        self.assertRaises(HasherBusy, first.generate_password_hash, 'test_pwd')
+        self.assertEqual(first.stats()['rejected'], 1)
+        # bulk work waits for the slot instead
+        threading.Timer(0.2, hashing._host_slots.release).start()
+        self.assertEqual(len(self.create_hasher(bulk_pool_size=1)
+                             .generate_password_hashes(['foo'])), 1)
+        self.assertTrue(second.check_password_hash(pw_hash, 'test_pwd'))
+
+    def test_hash_cost(self):
+        hasher = self.create_hasher()
+        self.assertEqual(hash_cost(hasher.generate_password_hash('test_pwd', 5)), 5)
+        self.assertEqual(hash_cost(hasher.generate_password_hash('test_pwd').decode()), 4)
+
+    def test_calibrate(self):
+        recommended, timings = calibrate(target_seconds=0, min_rounds=4, max_rounds=6, samples=1)
+        self.assertEqual(recommended, 4)
+        self.assertEqual(list(timings), [4])
+        recommended, timings = calibrate(target_seconds=60, min_rounds=4, max_rounds=5, samples=1)
+        self.assertEqual(recommended, 5)
+        self.assertEqual(list(timings), [4, 5])
+
+
+    def test_generate_password_hashes(self):
+        for hasher in (self.create_hasher(), self.create_hasher(pool_size=1, queue_depth=0),
+                       self.create_hasher(bulk_pool_size=2)):
+            pw_hashes = hasher.generate_password_hashes(['foo', 'bar', 'baz'])
+            self.assertEqual(len(pw_hashes), 3)
+            self.assertTrue(hasher.check_password_hash(pw_hashes[1], 'bar'))
+            self.assertFalse(hasher.check_password_hash(pw_hashes[1], 'foo'))
+
+    def test_bulk_hashing_leaves_the_pool_alone(self):
+        hasher = self.create_hasher(pool_size=1, queue_depth=0, bulk_pool_size=2)
+        # every interactive slot is taken, yet bulk work still goes ahead
+        hasher._slots.acquire()
+        self.addCleanup(hasher._slots.release)
+        pw_hashes = hasher.generate_password_hashes(['foo'] * 9)
+        self.assertEqual(len(pw_hashes), 9)
+        self.assertIsNone(hasher._executor)
+        self.assertEqual(hasher.stats()['calls'], 9)
+        self.assertRaises(ValueError, hasher.generate_password_hashes, ['foo', ''])
+
+    def test_warm_starts_the_pool(self):
+        hasher = self.create_hasher(pool_size=2, queue_depth=0)
+        hasher.warm()
+        self.assertEqual(len(hasher._executor._processes), 2)
+        self.assertEqual(hasher.stats()['calls'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
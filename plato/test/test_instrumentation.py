@@ -0,0 +1,75 @@
+import json
+
+from sqlalchemy import exc
+
+from plato import db, instrumentation
+from plato.instrumentation import Histogram
+from plato.test.base import BaseTestCase
+from plato.test.utils import add_user
+
+
+class TestInstrumentation(BaseTestCase):
+    def test_histogram_render(self):
+        histogram = Histogram('test_seconds', 'Test.', buckets=(0.1, 1))
+        histogram.observe('users.get_user', 0.05)
+        histogram.observe('users.get_user', 0.5)
+        histogram.observe('users.get_user', 5)
+        lines = histogram.render()
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{endpoint="users.get_user",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{endpoint="users.get_user",le="1"} 2', lines)
+        self.assertIn('test_seconds_bucket{endpoint="users.get_user",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{endpoint="users.get_user"} 3', lines)
+
+    def test_server_timing_header(self):
+        user = add_user('michael', 'michael@bar.com', 'test_pwd')
+        with self.client:
+            response = self.client.get(f'/users/{user.id}')
+            self.assertEqual(response.status_code, 200)
+            timing = response.headers['Server-Timing']
+            self.assertIn('db;dur=', timing)
+            self.assertIn('desc="1 queries"', timing)
+            self.assertIn('bcrypt;dur=', timing)
+            self.assertIn('jwt;dur=', timing)
+            self.assertIn('json;dur=', timing)
+            self.assertIn('total;dur=', timing)
+
+    def test_failing_query_leaves_no_start_time_behind(self):
+        with db.engine.connect() as conn:
+            with self.assertRaises(exc.DBAPIError):
+                conn.execute('SELECT * FROM no_such_table')
+            self.assertEqual(conn.info['query_started_at'], [])
+            conn.execute('SELECT 1')
+            self.assertEqual(conn.info['query_started_at'], [])
+
+    def test_login_records_bcrypt_and_jwt_time(self):
+        add_user('michael', 'michael@bar.com', 'test_pwd')
+        with self.client:
+            response = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(email='michael@bar.com', password='test_pwd')),
+                content_type='application/json'
+            )
+            timings = dict(
+                metric.split(';')[0:2] for metric in response.headers['Server-Timing'].split(', ')
+            )
+            self.assertGreater(float(timings['bcrypt'][len('dur='):]), 0)
+            self.assertGreater(float(timings['jwt'][len('dur='):]), 0)
+
+    def test_metrics(self):
+        instrumentation.clear()
+        add_user('michael', 'michael@bar.com', 'test_pwd')
+        with self.client:
+            self.client.get('/users')
+            response = self.client.get('/metrics')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('text/plain', response.content_type)
+            body = response.data.decode()
+            self.assertIn(
+                'plato_request_duration_seconds_count{endpoint="users.get_all_users"} 1', body)
+            self.assertIn('plato_db_statements_bucket{endpoint="users.get_all_users",le="1"} 1',
+                          body)
+            self.assertIn('plato_json_duration_seconds_count{endpoint="users.get_all_users"} 1',
+                          body)
+            self.assertIn('plato_token_cache_hits_total', body)
+            self.assertIn('plato_bcrypt_calls_total', body)
@@ -0,0 +1,151 @@
+import datetime
+import json
+import os
+import tempfile
+
+from flask_sqlalchemy import get_state
+
+from plato import db, replicas, listing_cache
+from plato.api.models import User
+from plato.test.base import BaseTestCase
+
+
+class TestReplicaRouting(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.app.config['SQLALCHEMY_BINDS'] = {
+            'replica_0': 'sqlite:///' + os.path.join(self.tmpdir.name, 'replica_0.db'),
+            'replica_1': 'sqlite:///' + os.path.join(self.tmpdir.name, 'replica_1.db'),
+            'replica_down': 'sqlite:///' + os.path.join(self.tmpdir.name, 'missing', 'x.db')
+        }
+        replicas.replicas = ['replica_0', 'replica_1']
+        replicas.reset()
+        for replica in replicas.replicas:
+            engine = db.get_engine(self.app, bind=replica)
+            db.Model.metadata.create_all(bind=engine)
+            self.add_replica_user(replica, replica)
+
+    def tearDown(self):
+        state = get_state(self.app)
+        for replica in self.app.config['SQLALCHEMY_BINDS']:
+            connector = state.connectors.pop(replica, None)
+            if connector is not None:
+                connector.get_engine().dispose()
+        self.app.config['SQLALCHEMY_BINDS'] = {}
+        replicas.replicas = []
+        replicas.reset()
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def add_replica_user(self, replica, username):
+        with db.get_engine(self.app, bind=replica).begin() as connection:
+            connection.execute(User.__table__.insert(), dict(
+                username=username, email=f'{username}@bar.com', password='',
+                active=True, admin=False, created_at=datetime.datetime.now()))
+
+    def test_reads_round_robin_over_replicas(self):
+        with self.client:
+            usernames = []
+            for _ in range(4):
+                response = self.client.get('/users/1')
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 200)
+                usernames.append(data['data']['username'])
+            self.assertEqual(usernames, ['replica_0', 'replica_1', 'replica_0', 'replica_1'])
+
+    def test_listing_read_from_a_replica_is_not_cached(self):
+        with self.client:
+            for expected in ('replica_0', 'replica_1'):
+                response = self.client.get('/users')
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(data['data']['users'][0]['username'], expected)
+        self.assertEqual(listing_cache.stats()['size'], 0)
+
+    def test_unhealthy_replica_is_skipped(self):
+        replicas.replicas = ['replica_down', 'replica_0']
+        replicas.reset()
+        with self.client:
+            for _ in range(3):
+                response = self.client.get('/users/1')
+                data = json.loads(response.data.decode())
+                self.assertEqual(data['data']['username'], 'replica_0')
+        self.assertEqual(replicas.healthy, {'replica_0'})
+
+    def test_no_healthy_replica_falls_back_to_primary(self):
+        replicas.replicas = ['replica_down']
+        replicas.reset()
+        with self.client:
+            response = self.client.get('/users/1')
+            self.assertEqual(response.status_code, 404)
+
+    def test_writes_go_to_the_primary(self):
+        with self.client:
+            self.client.post(
+                '/auth/register',
+                data=json.dumps(dict(
+                    username='foo',
+                    email='foo@bar.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json'
+            )
+        self.assertEqual(User.query.filter_by(username='foo').count(), 1)
+
+    def test_reads_after_register_stay_on_the_primary(self):
+        with self.client:
+            resp_register = self.client.post(
+                '/auth/register',
+                data=json.dumps(dict(
+                    username='foo',
+                    email='foo@bar.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json'
+            )
+            auth_token = json.loads(resp_register.data.decode())['auth_token']
+            response = self.client.get(
+                '/auth/status',
+                headers=dict(Authorization='Bearer ' + auth_token)
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['username'], 'foo')
+            response = self.client.get('/users/1')
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['data']['username'], 'foo')
+
+    def test_reads_after_register_in_another_worker_stay_on_the_primary(self):
+        with self.client:
+            resp_register = self.client.post(
+                '/auth/register',
+                data=json.dumps(dict(
+                    username='foo',
+                    email='foo@bar.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json'
+            )
+            self.assertIn(replicas.STICKY_COOKIE, resp_register.headers['Set-Cookie'])
+            auth_token = json.loads(resp_register.data.decode())['auth_token']
+            # the next requests land in workers that have not seen the write
+            replicas.recent_writes.clear()
+            response = self.client.get('/users/1')
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['data']['username'], 'foo')
+            # a client without cookies still carries the fresh token
+            self.client.cookie_jar.clear()
+            response = self.client.get(
+                '/auth/status',
+                headers=dict(Authorization='Bearer ' + auth_token)
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['username'], 'foo')
+            # and with neither, reads go back to the replicas
+            replicas.recent_writes.clear()
+            response = self.client.get('/users/1')
+            data = json.loads(response.data.decode())
+            self.assertIn(data['data']['username'], replicas.replicas)
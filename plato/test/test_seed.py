@@ -0,0 +1,30 @@
+from plato import hasher
+from plato.api.models import User
+from plato.seed import generate_users, seed_users, SEED_PASSWORD
+from plato.test.base import BaseTestCase
+
+
+class TestSeed(BaseTestCase):
+    def test_generate_users_is_deterministic(self):
+        self.assertEqual(list(generate_users(100, seed=1)), list(generate_users(100, seed=1)))
+        self.assertNotEqual(list(generate_users(100, seed=1)), list(generate_users(100, seed=2)))
+
+    def test_generate_users_mix(self):
+        users = list(generate_users(2000))
+        inactive = sum(1 for user in users if not user[3])
+        admins = sum(1 for user in users if user[4])
+        self.assertTrue(0 < inactive < 200)
+        self.assertTrue(0 < admins < 60)
+        self.assertEqual(len({user[0] for user in users}), 2000)
+
+    def test_seed_users(self):
+        messages = []
+        self.assertEqual(seed_users(25, batch_size=10, progress=messages.append), 25)
+        self.assertEqual(User.query.count(), 25)
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(messages[-1].startswith('25/25 users'))
+        user = User.query.filter_by(username='user1').first()
+        self.assertTrue(hasher.check_password_hash(user.password, SEED_PASSWORD))
+        # seeding again appends new users instead of clashing
+        seed_users(5)
+        self.assertEqual(User.query.count(), 30)
@@ -0,0 +1,60 @@
+import datetime
+import json
+import unittest
+
+from flask import json as flask_json
+
+from plato.serialization import JSONProvider, orjson
+from plato.test.base import BaseTestCase
+from plato.test.utils import add_user
+
+
+PAYLOAD = {
+    'status': 'success',
+    'data': {'id': 1, 'username': 'michael', 'created_at': datetime.datetime(2017, 6, 1, 12, 30)}
+}
+
+
+class TestJSONProvider(unittest.TestCase):
+    def provider(self, backend, **settings):
+        provider = JSONProvider()
+        provider.backend = backend
+        for name, value in settings.items():
+            setattr(provider, name, value)
+        return provider
+
+    def test_stdlib_backend(self):
+        body = self.provider('stdlib').dumps(PAYLOAD)
+        self.assertIsInstance(body, bytes)
+        self.assertNotIn(b'\n', body)
+        self.assertEqual(
+            json.loads(body.decode())['data']['created_at'], 'Thu, 01 Jun 2017 12:30:00 GMT')
+
+    def test_iso_dates(self):
+        body = self.provider('stdlib', datetime_format='iso').dumps(PAYLOAD)
+        self.assertEqual(json.loads(body.decode())['data']['created_at'], '2017-06-01T12:30:00')
+
+    def test_indent(self):
+        provider = self.provider('stdlib', indent=True)
+        self.assertIn(b'\n', provider.dumps(PAYLOAD))
+        self.assertNotIn(b'\n', provider.dumps(PAYLOAD, indent=False))
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson_matches_stdlib(self):
+        for settings in ({}, {'datetime_format': 'iso'}, {'sort_keys': True}):
+            self.assertEqual(
+                self.provider('orjson', **settings).dumps(PAYLOAD),
+                self.provider('stdlib', **settings).dumps(PAYLOAD)
+            )
+
+
+class TestJSONResponses(BaseTestCase):
+    def test_responses_match_flask_dates(self):
+        user = add_user('michael', 'michael@bar.com', 'test_pwd',
+                        datetime.datetime(2017, 6, 1, 12, 30))
+        with self.client:
+            response = self.client.get(f'/users/{user.id}')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.content_type, 'application/json')
+            self.assertEqual(data['data']['created_at'], flask_json.loads(
+                flask_json.dumps({'created_at': user.created_at}))['created_at'])
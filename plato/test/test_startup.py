@@ -0,0 +1,27 @@
+import sys
+import unittest
+
+from plato.startup import (
+    import_times, imported_modules, interpreter_time, STARTUP_BUDGET_SECONDS
+)
+
+
+class TestStartup(unittest.TestCase):
+    def test_manage_imports_within_budget(self):
+        elapsed, times = import_times('manage')
+        self.assertLess(elapsed - interpreter_time(), STARTUP_BUDGET_SECONDS)
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime needs Python 3.7')
+    def test_manage_does_not_load_coverage_or_the_app(self):
+        modules = imported_modules('manage')
+        self.assertIn('manage', modules)
+        self.assertNotIn('coverage', modules)
+        self.assertNotIn('plato.api.users', modules)
+        self.assertNotIn('plato.bench', modules)
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime needs Python 3.7')
+    def test_manage_does_not_load_the_extensions(self):
+        modules = imported_modules('manage')
+        for module in ('plato', 'flask_migrate', 'alembic', 'sqlalchemy',
+                       'bcrypt', 'jwt', 'orjson'):
+            self.assertNotIn(module, modules)
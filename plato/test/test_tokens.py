@@ -0,0 +1,255 @@
+import datetime
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from flask import Flask
+
+from plato import signer
+from plato.test.base import BaseTestCase
+from plato.test.utils import add_user
+from plato.tokens import TokenDenylist, TokenRevocations
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.config.update(config)
+    return app
+
+
+class TestTokenDenylist(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'denylist')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_entries_expire_with_their_token(self):
+        denylist = TokenDenylist(make_app())
+        denylist.add('live', time.time() + 60)
+        denylist.add('expiring', time.time() + 0.05)
+        denylist.add('expired', time.time() - 1)
+        denylist.add(None, time.time() + 60)
+        self.assertIn('live', denylist)
+        self.assertIn('expiring', denylist)
+        self.assertNotIn('expired', denylist)
+        self.assertNotIn(None, denylist)
+        time.sleep(0.1)
+        self.assertNotIn('expiring', denylist)
+        denylist.add('other', time.time() + 60)
+        self.assertEqual(len(denylist), 2)
+
+    def test_survives_a_restart(self):
+        denylist = TokenDenylist(make_app(TOKEN_DENYLIST_FILE=self.path))
+        denylist.add('live', time.time() + 60)
+        denylist.add('expiring', time.time() + 0.05)
+        time.sleep(0.1)
+        restarted = TokenDenylist(make_app(TOKEN_DENYLIST_FILE=self.path))
+        self.assertIn('live', restarted)
+        self.assertNotIn('expiring', restarted)
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+    def test_workers_share_the_file(self):
+        app = make_app(TOKEN_DENYLIST_FILE=self.path, TOKEN_DENYLIST_SYNC_INTERVAL=0)
+        first, second = TokenDenylist(app), TokenDenylist(app)
+        first.add('token', time.time() + 60)
+        self.assertIn('token', second)
+
+    def test_workers_without_a_file_do_not_share(self):
+        app = make_app(TOKEN_DENYLIST_SYNC_INTERVAL=0)
+        first, second = TokenDenylist(app), TokenDenylist(app)
+        first.add('token', time.time() + 60)
+        self.assertIn('token', first)
+        self.assertNotIn('token', second)
+
+    def test_several_workers_need_a_file(self):
+        with self.assertRaises(ValueError):
+            TokenDenylist(make_app(GUNICORN_WORKERS=4))
+        TokenDenylist(make_app(GUNICORN_WORKERS=4, TESTING=True))
+        TokenDenylist(make_app(GUNICORN_WORKERS=1))
+
+    def test_refuses_a_directory_others_can_write(self):
+        os.chmod(self.tmpdir.name, 0o777)
+        with self.assertRaises(ValueError):
+            TokenDenylist(make_app(TOKEN_DENYLIST_FILE=self.path))
+
+    def test_refuses_a_symlink(self):
+        target = os.path.join(self.tmpdir.name, 'target')
+        os.symlink(target, self.path)
+        with self.assertRaises(OSError):
+            TokenDenylist(make_app(TOKEN_DENYLIST_FILE=self.path))
+        self.assertFalse(os.path.exists(target))
+
+    def test_appends_wait_for_a_compaction(self):
+        denylist = TokenDenylist(make_app(TOKEN_DENYLIST_FILE=self.path))
+        # another worker compacting holds the lock exclusively
+        fd = os.open(self.path + '.lock', os.O_RDWR)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        adding = threading.Thread(target=denylist.add, args=('token', time.time() + 60))
+        adding.start()
+        adding.join(0.1)
+        self.assertTrue(adding.is_alive())
+        os.close(fd)
+        adding.join()
+        restarted = TokenDenylist(make_app(TOKEN_DENYLIST_FILE=self.path))
+        self.assertIn('token', restarted)
+
+
+class TestTokenRevocations(unittest.TestCase):
+    def test_revokes_tokens_issued_before(self):
+        revocations = TokenRevocations(make_app(TOKEN_REVOCATION_SIZE=10, TOKEN_CLAIMS_MAX_AGE=60))
+        issued_at = time.time()
+        self.assertFalse(revocations.is_revoked(1, issued_at))
+        revocations.revoke(1)
+        self.assertTrue(revocations.is_revoked(1, issued_at))
+        self.assertFalse(revocations.is_revoked(1, time.time() + 1))
+        self.assertFalse(revocations.is_revoked(2, issued_at))
+
+    def test_claims_need_a_shared_store(self):
+        with self.assertRaises(ValueError):
+            TokenRevocations(make_app(TOKEN_CLAIMS=True))
+
+
+def write_key(directory, kid, key, public_only=False):
+    if public_only:
+        pem = key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    else:
+        pem = key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption())
+    with open(os.path.join(directory, kid + '.pem'), 'wb') as f:
+        f.write(pem)
+
+
+def rsa_key():
+    return rsa.generate_private_key(65537, 2048, default_backend())
+
+
+class TestTokenSigner(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.payload = {
+            'sub': 1,
+            'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+        }
+
+    def tearDown(self):
+        self.app.config['JWT_KEYS_DIR'] = None
+        self.app.config['JWT_KEY_ID'] = None
+        self.app.config['JWT_ACCEPT_HS256'] = False
+        signer.init_app(self.app)
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def use_keys(self, kid):
+        self.app.config['JWT_KEYS_DIR'] = self.tmpdir.name
+        self.app.config['JWT_KEY_ID'] = kid
+        signer.init_app(self.app)
+
+    def test_rs256_with_kid(self):
+        write_key(self.tmpdir.name, '2026-10', rsa_key())
+        self.use_keys('2026-10')
+        token = signer.encode(self.payload)
+        header = jwt.get_unverified_header(token)
+        self.assertEqual(header['alg'], 'RS256')
+        self.assertEqual(header['kid'], '2026-10')
+        self.assertEqual(signer.decode(token)['sub'], 1)
+
+    def test_key_rotation(self):
+        old_key = rsa_key()
+        write_key(self.tmpdir.name, 'old', old_key)
+        self.use_keys('old')
+        old_token = signer.encode(self.payload)
+        # the old key is retired to its public half and a new one signs
+        write_key(self.tmpdir.name, 'old', old_key, public_only=True)
+        write_key(self.tmpdir.name, 'new', rsa_key())
+        self.use_keys('new')
+        new_token = signer.encode(self.payload)
+        self.assertEqual(jwt.get_unverified_header(new_token)['kid'], 'new')
+        self.assertEqual(signer.decode(old_token)['sub'], 1)
+        self.assertEqual(signer.decode(new_token)['sub'], 1)
+        os.remove(os.path.join(self.tmpdir.name, 'old.pem'))
+        self.use_keys('new')
+        with self.assertRaises(jwt.InvalidTokenError):
+            signer.decode(old_token)
+
+    def test_key_id_needs_a_private_key(self):
+        write_key(self.tmpdir.name, 'retired', rsa_key(), public_only=True)
+        with self.assertRaises(ValueError):
+            self.use_keys('retired')
+        with self.assertRaises(ValueError):
+            self.use_keys('missing')
+
+    def test_hs256_tokens_verify_during_switch_over(self):
+        token = signer.encode(self.payload)
+        self.assertEqual(jwt.get_unverified_header(token)['alg'], 'HS256')
+        write_key(self.tmpdir.name, 'current', rsa_key())
+        self.app.config['JWT_ACCEPT_HS256'] = True
+        self.use_keys('current')
+        self.assertEqual(signer.decode(token)['sub'], 1)
+
+    def test_hs256_tokens_refused_with_key_pairs(self):
+        token = signer.encode(self.payload)
+        write_key(self.tmpdir.name, 'current', rsa_key())
+        self.use_keys('current')
+        with self.assertRaises(jwt.InvalidTokenError):
+            signer.decode(token)
+
+    def test_ed25519(self):
+        write_key(self.tmpdir.name, 'ed', ed25519.Ed25519PrivateKey.generate())
+        if 'EdDSA' not in jwt.algorithms.get_default_algorithms():
+            with self.assertRaises(ValueError):
+                self.use_keys('ed')
+            return
+        self.use_keys('ed')
+        token = signer.encode(self.payload)
+        self.assertEqual(jwt.get_unverified_header(token)['alg'], 'EdDSA')
+        self.assertEqual(signer.decode(token)['sub'], 1)
+        self.assertEqual(signer.jwks()['keys'][0]['crv'], 'Ed25519')
+
+    def test_jwks_verifies_tokens_locally(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        write_key(self.tmpdir.name, 'current', rsa_key())
+        self.use_keys('current')
+        with self.client:
+            response = self.client.get('/.well-known/jwks.json')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('max-age=300', response.headers['Cache-Control'])
+            jwks = json.loads(response.data.decode())
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='foo@bar.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json'
+            )
+            auth_token = json.loads(resp_login.data.decode())['auth_token']
+            response = self.client.get(
+                '/auth/status',
+                headers=dict(Authorization='Bearer ' + auth_token)
+            )
+            self.assertEqual(response.status_code, 200)
+        jwk, = jwks['keys']
+        self.assertEqual((jwk['kid'], jwk['kty'], jwk['alg']), ('current', 'RSA', 'RS256'))
+        public = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+        payload = jwt.decode(auth_token, public, algorithms=['RS256'])
+        self.assertEqual(payload['sub'], 1)
+
+    def test_jwks_empty_with_shared_secret(self):
+        with self.client:
+            response = self.client.get('/.well-known/jwks.json')
+            self.assertEqual(json.loads(response.data.decode()), {'keys': []})
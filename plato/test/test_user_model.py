@@ -1,4 +1,7 @@
+from unittest import mock
+
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql
 
 from plato import db
 from plato.api.models import User
@@ -44,3 +47,62 @@ class TestUserModel(BaseTestCase):
         auth_token = user.encode_auth_token(user.id)
         self.assertTrue(isinstance(auth_token, bytes))
         self.assertTrue(User.decode_auth_token(auth_token), user.id)
+
+    def test_create_user(self):
+        user_id, conflict = User.create('foo', 'foo@bar.com', 'test_pwd')
+        db.session.commit()
+        self.assertIsNone(conflict)
+        user = User.query.filter_by(id=user_id).first()
+        self.assertEqual('foo', user.username)
+        self.assertTrue(user.active)
+        self.assertFalse(user.admin)
+        self.assertTrue(user.created_at)
+
+    def test_create_user_conflicts(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        self.assertEqual(User.create('bar', 'foo@bar.com', 'test_pwd'), (None, 'email'))
+        self.assertEqual(User.create('foo', 'bar@bar.com', 'test_pwd'), (None, 'username'))
+        self.assertEqual(User.create('foo', 'foo@bar.com', 'test_pwd'), (None, 'email'))
+        self.assertEqual(User.query.count(), 1)
+
+    def test_create_user_missing_username(self):
+        self.assertRaises(IntegrityError, User.create, None, 'foo@bar.com', 'test_pwd')
+        db.session.rollback()
+
+    def test_create_user_conflict_keeps_pending_work(self):
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        db.session.add(User('bar', 'bar@bar.com', 'test_pwd'))
+        self.assertEqual(User.create('foo', 'baz@bar.com', 'test_pwd'), (None, 'username'))
+        db.session.commit()
+        self.assertEqual(User.query.filter_by(username='bar').count(), 1)
+
+    def test_create_user_postgres(self):
+        '''Run User.create's Postgres branch, answering its INSERT as Postgres would'''
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        statements = []
+
+        def execute(statement, *args, **kwargs):
+            statements.append(str(statement.compile(dialect=postgresql.dialect())))
+            conflict = statement.parameters['email'] == 'foo@bar.com'
+            return mock.Mock(scalar=mock.Mock(return_value=None if conflict else 42))
+
+        with mock.patch.object(db.engine.dialect, 'name', 'postgresql'), \
+                mock.patch.object(db.session, 'execute', execute):
+            self.assertEqual(User.create('bar', 'foo@bar.com', 'test_pwd'), (None, 'email'))
+            self.assertEqual(User.create('bar', 'bar@bar.com', 'test_pwd'), (42, None))
+        self.assertEqual(len(statements), 2)
+        self.assertIn('ON CONFLICT DO NOTHING RETURNING users.id', statements[0])
+
+    def test_create_user_postgres_conflict_deleted_meanwhile(self):
+        '''The user the INSERT conflicted with is gone before it can be named'''
+        results = [None, 42]
+
+        def execute(statement, *args, **kwargs):
+            return mock.Mock(scalar=mock.Mock(return_value=results.pop(0)))
+
+        with mock.patch.object(db.engine.dialect, 'name', 'postgresql'), \
+                mock.patch.object(db.session, 'execute', execute):
+            self.assertEqual(User.create('foo', 'foo@bar.com', 'test_pwd'), (42, None))
+            results = [None, None]
+            self.assertRaises(RuntimeError, User.create, 'foo', 'foo@bar.com', 'test_pwd')
+        self.assertEqual(results, [])
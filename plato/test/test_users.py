@@ -1,10 +1,10 @@
 import json
 import datetime
 
-from plato.test.utils import add_user
+from plato.test.utils import add_user, count_queries
 from plato.test.base import BaseTestCase
 from plato.api.models import User
-from plato import db
+from plato import db, hasher, listing_cache
 
 
 class TestUserService(BaseTestCase):
@@ -205,6 +205,37 @@ class TestUserService(BaseTestCase):
             self.assertIn('Sorry, that email already exists.', data['message'])
             self.assertIn('fail', data['status'])
 
+    def test_add_duplicate_username(self):
+        '''Ensure error is thrown if the username already exists'''
+        add_user('michael', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='foo@bar.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json'
+            )
+            response = self.client.post(
+                '/users',
+                data=json.dumps(dict(
+                    username='michael',
+                    email='michael@bar.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json',
+                headers=dict(
+                    Authorization='Bearer ' + json.loads(
+                        resp_login.data.decode()
+                    )['auth_token']
+                )
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Sorry, that username already exists.', data['message'])
+            self.assertIn('fail', data['status'])
+
     def test_single_user(self):
         '''Ensure get single user behaves correctly'''
         user = add_user(username='michael', email='michael@bar.com', password='test_pwd')
@@ -217,6 +248,62 @@ class TestUserService(BaseTestCase):
             self.assertIn('michael@bar.com', data['data']['email'])
             self.assertIn('success', data['status'])
 
+    def test_single_user_etag(self):
+        '''Ensure a matching If-None-Match gets a 304 from the version alone'''
+        user = add_user(username='michael', email='michael@bar.com', password='test_pwd')
+        with self.client:
+            response = self.client.get(f'/users/{user.id}')
+            etag = response.headers['ETag']
+            self.assertTrue(etag)
+            with count_queries() as statements:
+                response = self.client.get(
+                    f'/users/{user.id}', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers['ETag'], etag)
+            self.assertEqual(len(statements), 1)
+            self.assertNotIn('password', statements[0])
+
+    def test_single_user_etag_changes_on_update(self):
+        '''Ensure an update bumps the version and so the ETag'''
+        user = add_user(username='michael', email='michael@bar.com', password='test_pwd')
+        with self.client:
+            etag = self.client.get(f'/users/{user.id}').headers['ETag']
+            user = User.query.get(user.id)
+            user.username = 'mike'
+            db.session.commit()
+            self.assertEqual(user.version, 2)
+            response = self.client.get(f'/users/{user.id}', headers={'If-None-Match': etag})
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['username'], 'mike')
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_single_user_fields(self):
+        '''Ensure ?fields= limits the response and the SELECT to those columns'''
+        user_id = add_user(username='michael', email='michael@bar.com', password='test_pwd').id
+        with self.client:
+            with count_queries() as statements:
+                response = self.client.get(f'/users/{user_id}?fields=id,username')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data'], {'id': user_id, 'username': 'michael'})
+            self.assertEqual(len(statements), 1)
+            self.assertNotIn('password', statements[0])
+            self.assertNotIn('email', statements[0])
+            full = self.client.get(f'/users/{user_id}')
+            self.assertNotEqual(response.headers['ETag'], full.headers['ETag'])
+
+    def test_single_user_invalid_fields(self):
+        '''Ensure unknown fields are rejected'''
+        user = add_user(username='michael', email='michael@bar.com', password='test_pwd')
+        with self.client:
+            response = self.client.get(f'/users/{user.id}?fields=username,password')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid fields.', data['message'])
+            self.assertIn('fail', data['status'])
+
     def test_single_user_no_id(self):
         '''Ensure error is thrown if an id is not provided'''
         with self.client:
@@ -285,3 +372,517 @@ class TestUserService(BaseTestCase):
             self.assertTrue(
                 data['message'] == 'You do not have permission to do that.')
             self.assertEqual(response.status_code, 403)
+
+    def test_all_users_paginated(self):
+        '''Ensure the user list can be walked page by page with a cursor'''
+        created_at = datetime.datetime.now()
+        for i in range(5):
+            add_user(f'user{i}', f'user{i}@bar.com', 'test_pwd', created_at)
+        with self.client:
+            response = self.client.get('/users?limit=2')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data['data']['users']), 2)
+            self.assertIn('user4', data['data']['users'][0]['username'])
+            self.assertIn('user3', data['data']['users'][1]['username'])
+            self.assertTrue(data['data']['next_cursor'])
+            self.assertIn('rel="next"', response.headers['Link'])
+            usernames = [user['username'] for user in data['data']['users']]
+            while data['data']['next_cursor']:
+                response = self.client.get(data['links']['next'])
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 200)
+                usernames.extend(user['username'] for user in data['data']['users'])
+            self.assertEqual(usernames, [f'user{i}' for i in range(4, -1, -1)])
+            self.assertIsNone(data['links']['next'])
+
+    def test_all_users_etag(self):
+        '''Ensure a listing page revalidates until one of its rows changes'''
+        add_user('michael', 'michael@bar.com', 'test_pwd')
+        add_user('fletcher', 'fletcher@realpython.com', 'test_pwd')
+        with self.client:
+            response = self.client.get('/users?limit=1')
+            etag = response.headers['ETag']
+            response = self.client.get('/users?limit=1', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get('/users?limit=2', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            add_user('new', 'new@bar.com', 'test_pwd')
+            response = self.client.get('/users?limit=1', headers={'If-None-Match': etag})
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['users'][0]['username'], 'new')
+
+    def test_all_users_cached(self):
+        '''Ensure a listing page is served from cache until a user is added'''
+        add_user('michael', 'michael@bar.com', 'test_pwd')
+        with self.client:
+            hits = listing_cache.stats()['hits']
+            first = self.client.get('/users')
+            with count_queries() as statements:
+                response = self.client.get('/users')
+            self.assertEqual(statements, [])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, first.data)
+            self.assertEqual(response.headers['ETag'], first.headers['ETag'])
+            self.assertEqual(listing_cache.stats()['hits'] - hits, 1)
+            resp_register = self.client.post(
+                '/auth/register',
+                data=json.dumps(dict(
+                    username='fletcher',
+                    email='fletcher@realpython.com',
+                    password='test_pwd'
+                )),
+                content_type='application/json'
+            )
+            self.assertEqual(resp_register.status_code, 201)
+            response = self.client.get('/users')
+            data = json.loads(response.data.decode())
+            self.assertEqual(len(data['data']['users']), 2)
+
+    def test_all_users_cache_invalidated_by_update_and_delete(self):
+        '''Ensure ORM updates and deletes drop the cached pages showing the user'''
+        user = add_user('michael', 'michael@bar.com', 'test_pwd')
+        with self.client:
+            self.client.get('/users')
+            user.username = 'mike'
+            db.session.commit()
+            data = json.loads(self.client.get('/users').data.decode())
+            self.assertEqual(data['data']['users'][0]['username'], 'mike')
+            db.session.delete(user)
+            db.session.commit()
+            data = json.loads(self.client.get('/users').data.decode())
+            self.assertEqual(data['data']['users'], [])
+
+    def test_all_users_cache_invalidated_despite_a_conflicting_create(self):
+        '''Ensure a failed SAVEPOINT keeps the invalidations queued before it'''
+        add_user('admin', 'admin@bar.com', 'test_pwd')
+        with self.client:
+            self.client.get('/users')
+            db.session.add(User('bob', 'bob@bar.com', 'test_pwd'))
+            user_id, conflict = User.create('admin', 'other@bar.com', 'test_pwd')
+            self.assertEqual((user_id, conflict), (None, 'username'))
+            self.assertEqual(len(db.session.info['listing_changes']), 1)
+            # nothing is dropped before the outer transaction commits
+            data = json.loads(self.client.get('/users').data.decode())
+            self.assertEqual([u['username'] for u in data['data']['users']], ['admin'])
+            db.session.commit()
+            data = json.loads(self.client.get('/users').data.decode())
+            self.assertCountEqual([u['username'] for u in data['data']['users']], ['admin', 'bob'])
+
+    def test_all_users_cache_keeps_pages_an_insert_does_not_touch(self):
+        '''Ensure adding a user only invalidates the pages it lands on'''
+        created_at = datetime.datetime.now() - datetime.timedelta(days=1)
+        for i in range(4):
+            add_user(f'user{i}', f'user{i}@bar.com', 'test_pwd', created_at)
+        with self.client:
+            data = json.loads(self.client.get('/users?limit=2').data.decode())
+            second_page = data['links']['next']
+            self.client.get(second_page)
+            add_user('newest', 'newest@bar.com', 'test_pwd', datetime.datetime.now())
+            with count_queries() as statements:
+                self.client.get(second_page)
+            self.assertEqual(statements, [])
+            data = json.loads(self.client.get('/users?limit=2').data.decode())
+            self.assertEqual(data['data']['users'][0]['username'], 'newest')
+
+    def test_all_users_fields(self):
+        '''Ensure ?fields= applies to every page and to the NDJSON stream'''
+        created_at = datetime.datetime.now()
+        for i in range(3):
+            add_user(f'user{i}', f'user{i}@bar.com', 'test_pwd', created_at)
+        with self.client:
+            with count_queries() as statements:
+                response = self.client.get('/users?limit=2&fields=username')
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['data']['users'], [{'username': 'user2'}, {'username': 'user1'}])
+            self.assertNotIn('password', statements[0])
+            self.assertNotIn('email', statements[0])
+            response = self.client.get(data['links']['next'])
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['data']['users'], [{'username': 'user0'}])
+            response = self.client.get('/users?fields=email,id')
+            data = json.loads(response.data.decode())
+            self.assertEqual(set(data['data']['users'][0]), {'email', 'id'})
+            response = self.client.get('/users?fields=password')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get('/users?stream=ndjson&fields=id')
+        lines = response.data.decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{'id': 3}, {'id': 2}, {'id': 1}])
+
+    def test_all_users_invalid_cursor(self):
+        '''Ensure error is thrown if the cursor is malformed'''
+        with self.client:
+            response = self.client.get('/users?cursor=invalid')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid pagination parameters.', data['message'])
+            self.assertIn('fail', data['status'])
+
+    def test_all_users_invalid_limit(self):
+        '''Ensure error is thrown if the limit is out of range'''
+        with self.client:
+            response = self.client.get('/users?limit=0')
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get('/users?limit=100000')
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get('/users?limit=foo')
+            self.assertEqual(response.status_code, 400)
+
+    def test_all_users_ndjson_stream(self):
+        '''Ensure every user is streamed as one JSON document per line'''
+        created_at = datetime.datetime.now() + datetime.timedelta(-30)
+        add_user('michael', 'michael_foo@bar.com', 'test_pwd')
+        add_user('fletcher', 'fletcher_foo@bar.com', 'test_pwd', created_at)
+        response = self.client.get('/users?stream=ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, 'application/x-ndjson')
+        lines = response.data.decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        users = [json.loads(line) for line in lines]
+        self.assertEqual(users[0]['username'], 'michael')
+        self.assertEqual(users[1]['username'], 'fletcher')
+        self.assertTrue('created_at' in users[1])
+        self.assertFalse('password' in users[1])
+
+    def test_all_users_unsupported_stream(self):
+        '''Ensure error is thrown for an unknown stream format'''
+        with self.client:
+            response = self.client.get('/users?stream=csv')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Unsupported stream format.', data['message'])
+
+    def test_users_by_id(self):
+        '''Ensure ?ids= resolves every id with one query and lists the misses'''
+        michael = add_user('michael', 'michael@bar.com', 'test_pwd')
+        fletcher = add_user('fletcher', 'fletcher@bar.com', 'test_pwd')
+        ids = f'{fletcher.id},{michael.id},999'
+        with self.client:
+            with count_queries() as statements:
+                response = self.client.get(f'/users?ids={ids}&fields=username')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(statements), 1)
+            self.assertIn(' IN ', statements[0])
+            self.assertEqual(data['data']['users'], {
+                str(fletcher.id): {'username': 'fletcher'},
+                str(michael.id): {'username': 'michael'}
+            })
+            self.assertEqual(data['data']['missing'], [999])
+
+    def test_users_by_id_invalid(self):
+        '''Ensure malformed or too many ids are rejected'''
+        with self.client:
+            response = self.client.get('/users?ids=1,foo')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid ids.', data['message'])
+            self.app.config['USERS_LOOKUP_MAX_KEYS'] = 2
+            try:
+                response = self.client.get('/users?ids=1,2,3')
+            finally:
+                self.app.config['USERS_LOOKUP_MAX_KEYS'] = 500
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Too many users in one lookup.', data['message'])
+
+    def test_users_lookup(self):
+        '''Ensure ids, usernames and emails resolve in one query, keyed by input'''
+        michael_id = add_user('michael', 'michael@bar.com', 'test_pwd').id
+        add_user('fletcher', 'fletcher@bar.com', 'test_pwd')
+        with self.client:
+            with count_queries() as statements:
+                response = self.client.post(
+                    '/users/lookup',
+                    data=json.dumps(dict(
+                        ids=[michael_id, 999],
+                        usernames=['fletcher', 'nobody'],
+                        emails=['michael@bar.com']
+                    )),
+                    content_type='application/json'
+                )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(statements), 1)
+            self.assertEqual(data['data']['ids'][str(michael_id)]['username'], 'michael')
+            self.assertEqual(data['data']['usernames']['fletcher']['email'], 'fletcher@bar.com')
+            self.assertEqual(data['data']['emails']['michael@bar.com']['id'], michael_id)
+            self.assertFalse('password' in data['data']['emails']['michael@bar.com'])
+            self.assertEqual(data['data']['missing'], {
+                'ids': [999], 'usernames': ['nobody'], 'emails': []
+            })
+
+    def test_users_lookup_invalid(self):
+        '''Ensure an empty, malformed or oversized lookup is rejected'''
+        with self.client:
+            for payload in ({}, {'ids': 'foo'}, {'ids': ['foo']}, {'usernames': [1]}, []):
+                response = self.client.post(
+                    '/users/lookup',
+                    data=json.dumps(payload),
+                    content_type='application/json'
+                )
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('Invalid payload.', data['message'])
+            self.app.config['USERS_LOOKUP_MAX_KEYS'] = 2
+            try:
+                response = self.client.post(
+                    '/users/lookup',
+                    data=json.dumps(dict(ids=[1, 2], emails=['foo@bar.com'])),
+                    content_type='application/json'
+                )
+            finally:
+                self.app.config['USERS_LOOKUP_MAX_KEYS'] = 500
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Too many users in one lookup.', data['message'])
+
+    def test_add_user_query_count(self):
+        '''Ensure the authenticated user is loaded at most once per request'''
+        add_user('test', 'test@test.com', 'test')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='test@test.com',
+                    password='test'
+                )),
+                content_type='application/json'
+            )
+            headers = dict(
+                Authorization='Bearer ' + json.loads(resp_login.data.decode())['auth_token']
+            )
+            # authenticate's user lookup and the insert
+            with count_queries() as statements:
+                response = self.client.post(
+                    '/users',
+                    data=json.dumps(dict(
+                        username='michael',
+                        email='michael@bar.com',
+                        password='test_pwd'
+                    )),
+                    content_type='application/json',
+                    headers=headers
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(statements), 2)
+            # token cached: no user lookup at all
+            with count_queries() as statements:
+                response = self.client.post(
+                    '/users',
+                    data=json.dumps(dict(
+                        username='fletcher',
+                        email='fletcher@bar.com',
+                        password='test_pwd'
+                    )),
+                    content_type='application/json',
+                    headers=headers
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(statements), 1)
+
+    def test_add_users_bulk_query_count(self):
+        '''Ensure a bulk import loads no user for authentication and batches its queries'''
+        with self.client:
+            headers = self.login_admin()
+            rows = [
+                dict(username=f'user{i}', email=f'user{i}@bar.com', password='test_pwd')
+                for i in range(3)
+            ]
+            # authenticate's user lookup, the existence check and, off Postgres, an INSERT per row
+            with count_queries() as statements:
+                response = self.client.post(
+                    '/users/bulk',
+                    data=json.dumps(rows),
+                    content_type='application/json',
+                    headers=headers
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len([s for s in statements if s.startswith('SELECT')]), 2)
+            inserts = 1 if db.engine.dialect.name == 'postgresql' else len(rows)
+            self.assertEqual(len([s for s in statements if s.startswith('INSERT')]), inserts)
+            # token cached: only the existence check is left to SELECT
+            rows = [
+                dict(username=f'other{i}', email=f'other{i}@bar.com', password='test_pwd')
+                for i in range(3)
+            ]
+            with count_queries() as statements:
+                response = self.client.post(
+                    '/users/bulk',
+                    data=json.dumps(rows),
+                    content_type='application/json',
+                    headers=headers
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len([s for s in statements if s.startswith('SELECT')]), 1)
+
+    def login_admin(self):
+        add_user('admin', 'admin@test.com', 'test')
+        user = User.query.filter_by(email='admin@test.com').first()
+        user.admin = True
+        db.session.commit()
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(
+                email='admin@test.com',
+                password='test'
+            )),
+            content_type='application/json'
+        )
+        return dict(
+            Authorization='Bearer ' + json.loads(resp_login.data.decode())['auth_token']
+        )
+
+    def test_add_users_bulk(self):
+        '''Ensure users can be imported in bulk with per-row results'''
+        add_user('foo', 'foo@bar.com', 'test_pwd')
+        with self.client:
+            headers = self.login_admin()
+            response = self.client.post(
+                '/users/bulk',
+                data=json.dumps([
+                    dict(username='michael', email='michael@bar.com', password='test_pwd'),
+                    dict(username='foo2', email='foo@bar.com', password='test_pwd'),
+                    dict(username='fletcher', email='fletcher@bar.com'),
+                    dict(username='michael', email='michael2@bar.com', password='test_pwd'),
+                    dict(username='jane', email='jane@bar.com', password='test_pwd')
+                ]),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('success', data['status'])
+            self.assertEqual(data['data']['created'], 2)
+            self.assertEqual(data['data']['failed'], 3)
+            results = data['data']['results']
+            self.assertEqual([result['status'] for result in results],
+                             ['success', 'fail', 'fail', 'fail', 'success'])
+            self.assertIn('michael@bar.com was added!', results[0]['message'])
+            self.assertIn('Sorry, that user already exists.', results[1]['message'])
+            self.assertIn('Invalid payload.', results[2]['message'])
+            self.assertIn('Duplicate user in request.', results[3]['message'])
+        user = User.query.filter_by(email='jane@bar.com').first()
+        self.assertTrue(user.active)
+        self.assertFalse(user.admin)
+        with self.client:
+            response = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(email='jane@bar.com', password='test_pwd')),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 200)
+
+    def test_add_users_bulk_concurrent_conflict(self):
+        '''Ensure a user added while the import hashes only fails its own row'''
+        with self.client:
+            headers = self.login_admin()
+            generate_password_hashes = hasher.generate_password_hashes
+
+            def hash_while_another_client_registers(passwords, rounds=None):
+                with db.engine.begin() as connection:
+                    connection.execute(User.__table__.insert(), dict(
+                        username='jane', email='jane@bar.com', password='',
+                        active=True, admin=False, created_at=datetime.datetime.now()))
+                return generate_password_hashes(passwords, rounds)
+
+            hasher.generate_password_hashes = hash_while_another_client_registers
+            try:
+                response = self.client.post(
+                    '/users/bulk',
+                    data=json.dumps([
+                        dict(username='michael', email='michael@bar.com', password='test_pwd'),
+                        dict(username='jane', email='jane@bar.com', password='test_pwd')
+                    ]),
+                    content_type='application/json',
+                    headers=headers
+                )
+            finally:
+                del hasher.generate_password_hashes
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['created'], 1)
+            self.assertEqual(data['data']['results'][0]['status'], 'success')
+            self.assertEqual(data['data']['results'][1]['status'], 'fail')
+            self.assertIn('Sorry, that user already exists.', data['data']['results'][1]['message'])
+        self.assertEqual(User.query.filter_by(username='michael').count(), 1)
+
+    def test_add_users_bulk_ndjson(self):
+        '''Ensure an NDJSON body is accepted for bulk import'''
+        with self.client:
+            headers = self.login_admin()
+            body = '\n'.join(json.dumps(dict(
+                username=f'user{i}', email=f'user{i}@bar.com', password='test_pwd'
+            )) for i in range(3))
+            response = self.client.post(
+                '/users/bulk',
+                data=body,
+                content_type='application/x-ndjson',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['created'], 3)
+        self.assertEqual(User.query.count(), 4)
+
+    def test_add_users_bulk_invalid_json(self):
+        with self.client:
+            headers = self.login_admin()
+            response = self.client.post(
+                '/users/bulk',
+                data=json.dumps(dict(username='michael')),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid payload.', data['message'])
+
+    def test_add_users_bulk_too_many(self):
+        with self.client:
+            headers = self.login_admin()
+            max_rows = self.app.config['USERS_BULK_MAX_ROWS']
+            self.app.config['USERS_BULK_MAX_ROWS'] = 1
+            try:
+                response = self.client.post(
+                    '/users/bulk',
+                    data=json.dumps([
+                        dict(username='michael', email='michael@bar.com', password='test_pwd'),
+                        dict(username='jane', email='jane@bar.com', password='test_pwd')
+                    ]),
+                    content_type='application/json',
+                    headers=headers
+                )
+            finally:
+                self.app.config['USERS_BULK_MAX_ROWS'] = max_rows
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Too many users in one request.', data['message'])
+
+    def test_add_users_bulk_not_admin(self):
+        add_user('test', 'test@test.com', 'test')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='test@test.com',
+                    password='test'
+                )),
+                content_type='application/json'
+            )
+            response = self.client.post(
+                '/users/bulk',
+                data=json.dumps([
+                    dict(username='michael', email='michael@bar.com', password='test_pwd')
+                ]),
+                content_type='application/json',
+                headers=dict(
+                    Authorization='Bearer ' + json.loads(
+                        resp_login.data.decode()
+                    )['auth_token']
+                )
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 403)
+            self.assertIn('You do not have permission to do that.', data['message'])
@@ -0,0 +1,29 @@
+from unittest import mock
+
+from sqlalchemy import create_engine
+
+from plato import availability, hasher
+from plato.database import TimedQueuePool, pool_stats
+from plato.test.base import BaseTestCase
+from plato.test.utils import add_user
+from plato.warmup import warm_up, warm_worker
+
+
+class TestWarmUp(BaseTestCase):
+    def test_warm_up_builds_the_availability_index(self):
+        add_user('michael', 'michael@bar.com', 'test_pwd')
+        warm_up(self.app)
+        self.assertIsNotNone(availability._filters)
+        self.assertTrue(availability.might_exist('username', 'michael'))
+
+    def test_warm_worker_opens_one_connection_per_engine(self):
+        engine = create_engine('sqlite://', poolclass=TimedQueuePool, pool_size=5)
+        self.addCleanup(engine.dispose)
+        with mock.patch('plato.warmup.database_engines', return_value=[('primary', engine)]):
+            warm_worker(self.app)
+        self.assertEqual(pool_stats(engine)['checked_in'], 1)
+
+    def test_warm_worker_runs_bcrypt(self):
+        calls = hasher.stats()['calls']
+        warm_worker(self.app)
+        self.assertGreater(hasher.stats()['calls'], calls)
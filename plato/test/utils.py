@@ -1,4 +1,7 @@
 import datetime
+from contextlib import contextmanager
+
+from sqlalchemy import event
 
 from plato import db
 from plato.api.models import User
@@ -9,3 +12,19 @@ def add_user(username, email, password, created_at=datetime.datetime.now()):
     db.session.add(user)
     db.session.commit()
     return user
+
+
+@contextmanager
+def count_queries():
+    '''Collect the SQL statements executed inside the block, savepoint bookkeeping aside'''
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith(('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')):
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
@@ -0,0 +1,299 @@
+import base64
+import fcntl
+import heapq
+import os
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import jwt
+from flask import current_app
+
+from plato.cache import TTLCache, RedisCache
+
+
+class TokenRevocations:
+    '''Voids the claims in tokens issued before a user's active/admin flags changed
+
+    A token that carries its own claims is trusted without loading the
+    user, so deactivating or demoting someone has to be announced here
+    instead. Each revocation is a per-user timestamp: tokens issued up to
+    then are refused. Entries only need to outlive the tokens they void,
+    so they expire after TOKEN_CLAIMS_MAX_AGE. TOKEN_REVOCATION_URL names
+    the Redis server every worker shares them through; TOKEN_CLAIMS
+    refuses to start without it, since a revocation kept in one process
+    would leave the others trusting the old claims.
+    '''
+
+    def __init__(self, app=None):
+        self.backend = TTLCache(maxsize=0, ttl=0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        maxsize = app.config.get('TOKEN_REVOCATION_SIZE', 0)
+        ttl = app.config.get('TOKEN_CLAIMS_MAX_AGE', 0)
+        url = app.config.get('TOKEN_REVOCATION_URL')
+        if app.config.get('TOKEN_CLAIMS') and not url:
+            raise ValueError('TOKEN_CLAIMS needs TOKEN_REVOCATION_URL, '
+                             'so revocations reach every worker')
+        if url:
+            self.backend = RedisCache(url, 'plato:revoked:', maxsize, ttl)
+        else:
+            self.backend = TTLCache(maxsize, ttl)
+
+    def revoke(self, user_id, revoked_at=None):
+        '''Refuse every claim-carrying token issued to user_id so far'''
+        self.backend.set(str(user_id), time.time() if revoked_at is None else revoked_at)
+
+    def is_revoked(self, user_id, issued_at):
+        revoked_at = self.backend.get(str(user_id))
+        return revoked_at is not None and issued_at <= revoked_at
+
+    def clear(self):
+        self.backend.clear()
+
+
+class TokenDenylist:
+    '''Token ids (jti) that are refused until their token would have expired anyway
+
+    Checking a token is one dict lookup. Entries are dropped once their
+    token's exp passes, so the set only ever holds live logged-out tokens.
+    With TOKEN_DENYLIST_FILE set, every entry is also appended to that
+    file and read back on start, so logouts survive restarts; workers
+    sharing the file pick up each other's entries within
+    TOKEN_DENYLIST_SYNC_INTERVAL seconds. Without it a logout is only
+    seen by the process that handled it, so it is required outside debug
+    and testing whenever gunicorn runs several workers.
+
+    The file has to be in a directory other users cannot write to, and a
+    symlink in its place is refused. Compaction rewrites it under an
+    exclusive flock on <file>.lock, which every append shares, so no
+    worker's logout is lost to a compaction running elsewhere.
+    '''
+
+    def __init__(self, app=None):
+        self.path = None
+        self.sync_interval = 1
+        self._expiry = {}
+        self._heap = []
+        self._file_id = None
+        self._offset = 0
+        self._synced_at = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config.get('TOKEN_DENYLIST_FILE')
+        self.sync_interval = app.config.get('TOKEN_DENYLIST_SYNC_INTERVAL', 1)
+        if not self.path and app.config.get('GUNICORN_WORKERS', 1) > 1 \
+                and not (app.debug or app.testing):
+            raise ValueError('TOKEN_DENYLIST_FILE is required so every worker sees each logout')
+        self.clear()
+        if self.path:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            if os.stat(directory).st_mode & stat.S_IWOTH:
+                raise ValueError(f'TOKEN_DENYLIST_FILE must not be in {directory}, '
+                                 'which other users can write to')
+            self.compact()
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def __contains__(self, jti):
+        now = time.time()
+        if self.path and now - self._synced_at >= self.sync_interval:
+            self.sync()
+        expires_at = self._expiry.get(jti)
+        return expires_at is not None and expires_at > now
+
+    def add(self, jti, expires_at):
+        '''Refuse the token jti until expires_at, a POSIX timestamp'''
+        if jti is None or expires_at <= time.time():
+            return
+        with self._lock:
+            self._remember(jti, expires_at)
+            if self.path:
+                with self._file_lock(fcntl.LOCK_SH):
+                    flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_NOFOLLOW
+                    fd = os.open(self.path, flags, 0o600)
+                    with open(fd, 'a') as f:
+                        f.write(f'{jti} {expires_at}\n')
+
+    def sync(self):
+        '''Read the entries other processes appended to the file since the last sync'''
+        with self._lock:
+            self._sync()
+
+    def compact(self):
+        '''Rewrite the file with only the entries that have not expired'''
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            self._sync()
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+                for jti, expires_at in self._expiry.items():
+                    f.write(f'{jti} {expires_at}\n')
+            os.replace(f.name, self.path)
+            self._file_id = os.stat(self.path).st_ino
+            self._offset = os.path.getsize(self.path)
+
+    def clear(self):
+        with self._lock:
+            self._expiry.clear()
+            self._heap = []
+            self._file_id = None
+            self._offset = 0
+            self._synced_at = 0
+
+    def _sync(self):
+        self._synced_at = time.time()
+        try:
+            with open(os.open(self.path, os.O_RDONLY | os.O_NOFOLLOW), 'rb') as f:
+                file_id = os.fstat(f.fileno()).st_ino
+                if file_id != self._file_id:
+                    # replaced by a compaction: read it from the start
+                    self._file_id, self._offset = file_id, 0
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # a line still being written is left for the next sync
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        for line in data[:end].decode().splitlines():
+            jti, expires_at = line.split()
+            self._remember(jti, float(expires_at))
+
+    @contextmanager
+    def _file_lock(self, operation):
+        # on a file of its own, since compaction replaces the denylist file
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            os.close(fd)
+
+    def _remember(self, jti, expires_at):
+        now = time.time()
+        if expires_at > now and self._expiry.get(jti) != expires_at:
+            self._expiry[jti] = expires_at
+            heapq.heappush(self._heap, (expires_at, jti))
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, jti = heapq.heappop(self._heap)
+            if self._expiry.get(jti) == expires_at:
+                del self._expiry[jti]
+
+
+def _b64url(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def _b64url_uint(number):
+    return _b64url(number.to_bytes((number.bit_length() + 7) // 8 or 1, 'big'))
+
+
+def _as_bytes(token):
+    # PyJWT 1 returns bytes, PyJWT 2 str
+    return token if isinstance(token, bytes) else token.encode()
+
+
+class TokenSigner:
+    '''Signs and verifies auth tokens, with SECRET_KEY or with rotating key pairs
+
+    Without JWT_KEYS_DIR tokens are HS256 with SECRET_KEY, as before. With
+    it, every <kid>.pem in that directory is loaded: RSA keys sign RS256,
+    Ed25519 keys EdDSA (PyJWT 2 and up only). Tokens are signed with the
+    private key JWT_KEY_ID and carry its kid; any key in the directory
+    verifies, so a new key can take over while tokens signed with the
+    previous one run out. A retired key only needs its public PEM. Tokens
+    signed with SECRET_KEY are refused once key pairs are in use, unless
+    JWT_ACCEPT_HS256 is set for the switch-over. The public keys are
+    published as a JWKS for other services to verify tokens themselves.
+    Needs the cryptography package.
+    '''
+
+    def __init__(self, app=None):
+        self.kid = None
+        self.keys = {}
+        self.accept_hs256 = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.kid = app.config.get('JWT_KEY_ID')
+        directory = app.config.get('JWT_KEYS_DIR')
+        self.keys = self.load_keys(directory) if directory else {}
+        self.accept_hs256 = not self.keys or app.config.get('JWT_ACCEPT_HS256', False)
+        if self.keys and (self.kid not in self.keys or self.keys[self.kid][1] is None):
+            raise ValueError(f'JWT_KEY_ID {self.kid!r} names no private key in {directory}')
+
+    @staticmethod
+    def load_keys(directory):
+        '''Map each <kid>.pem in directory to (algorithm, private key or None, public key)'''
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+        keys = {}
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.pem'):
+                continue
+            with open(os.path.join(directory, name), 'rb') as f:
+                pem = f.read()
+            if b'PRIVATE KEY' in pem:
+                private = serialization.load_pem_private_key(pem, None, default_backend())
+                public = private.public_key()
+            else:
+                private = None
+                public = serialization.load_pem_public_key(pem, default_backend())
+            if isinstance(public, rsa.RSAPublicKey):
+                algorithm = 'RS256'
+            elif isinstance(public, ed25519.Ed25519PublicKey):
+                algorithm = 'EdDSA'
+                if algorithm not in jwt.algorithms.get_default_algorithms():
+                    raise ValueError(f'{name}: Ed25519 keys need PyJWT 2 or later')
+            else:
+                raise ValueError(f'{name}: only RSA and Ed25519 keys are supported')
+            keys[name[:-len('.pem')]] = (algorithm, private, public)
+        return keys
+
+    def encode(self, payload):
+        '''Sign payload - :return: the token as bytes'''
+        if not self.keys:
+            return _as_bytes(jwt.encode(payload, current_app.config.get('SECRET_KEY'),
+                                        algorithm='HS256'))
+        algorithm, private, _ = self.keys[self.kid]
+        return _as_bytes(jwt.encode(payload, private, algorithm=algorithm,
+                                    headers={'kid': self.kid}))
+
+    def decode(self, token):
+        '''Verify token and return its payload; raises jwt.InvalidTokenError'''
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is None:
+            if not self.accept_hs256:
+                raise jwt.InvalidTokenError('Tokens signed with SECRET_KEY are no longer accepted')
+            # tokens signed before key pairs were configured, until they expire
+            return jwt.decode(token, current_app.config.get('SECRET_KEY'), algorithms=['HS256'])
+        if kid not in self.keys:
+            raise jwt.InvalidTokenError(f'Unknown key {kid}')
+        algorithm, _, public = self.keys[kid]
+        return jwt.decode(token, public, algorithms=[algorithm])
+
+    def jwks(self):
+        '''The public keys as a JSON Web Key Set'''
+        from cryptography.hazmat.primitives import serialization
+        keys = []
+        for kid, (algorithm, _, public) in self.keys.items():
+            jwk = {'kid': kid, 'use': 'sig', 'alg': algorithm}
+            if algorithm == 'RS256':
+                numbers = public.public_numbers()
+                jwk.update(kty='RSA', n=_b64url_uint(numbers.n), e=_b64url_uint(numbers.e))
+            else:
+                raw = public.public_bytes(serialization.Encoding.Raw,
+                                          serialization.PublicFormat.Raw)
+                jwk.update(kty='OKP', crv='Ed25519', x=_b64url(raw))
+            keys.append(jwk)
+        return {'keys': keys}
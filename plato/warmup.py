@@ -0,0 +1,34 @@
+from sqlalchemy import orm
+
+from plato import db, hasher, availability
+from plato.api.health import database_engines
+from plato.api.models import User
+
+
+def warm_up(app):
+    '''Pay the one-off startup costs before gunicorn forks its workers
+
+    Runs in the master with preload_app, so every worker inherits the
+    configured mappers, the loaded JWT backend and a built availability
+    index. Database connections are closed again afterwards because they
+    must not be shared across the fork.
+    '''
+    with app.app_context():
+        orm.configure_mappers()
+        User.decode_auth_payload(User.encode_auth_token(0))
+        availability.build()
+        db.session.remove()
+        for _, engine in database_engines():
+            engine.dispose()
+
+
+def warm_worker(app):
+    '''Open a first connection per database and start the bcrypt workers of one worker process
+
+    Only one connection each: every worker warming a full pool at once
+    could exceed the database's max_connections before serving anything.
+    '''
+    with app.app_context():
+        for _, engine in database_engines():
+            engine.connect().close()
+        hasher.warm()
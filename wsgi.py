@@ -0,0 +1,6 @@
+from plato import create_app
+from plato.warmup import warm_up
+
+
+app = create_app()
+warm_up(app)